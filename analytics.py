@@ -0,0 +1,248 @@
+# analytics.py
+
+"""
+Índice de séries temporais para consultas de lucro em qualquer intervalo de datas.
+
+Mantém somas acumuladas (prefix sums) por dia local e por sabor em arrays NumPy, de modo que
+qualquer total entre duas datas sai de duas leituras do array, sem varrer ou agrupar o histórico.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import arquivamento
+import config
+import google_drive as drive
+import journal
+
+# Ordem das métricas no último eixo dos arrays
+METRICAS = ('faturamento', 'lucro', 'quantidade', 'custo_consumo')
+_FATURAMENTO, _LUCRO, _QUANTIDADE, _CUSTO_CONSUMO = range(len(METRICAS))
+
+DIAS_DA_SEMANA = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+# Linhas sem sabor entram nos totais sob este nome
+SABOR_OUTROS = 'outros'
+
+
+class IndiceLucro:
+    """
+    Somas acumuladas por dia (calendário contínuo a partir do primeiro dia com movimento), sabor e métrica.
+    Valores monetários em centavos (int64), como no esquema compacto, para que as somas sejam exatas.
+
+    _acumulado[i] guarda a soma dos dias [0, i); o total de um intervalo é _acumulado[fim + 1] - _acumulado[inicio].
+    _acumulado_semana faz o mesmo separando por dia da semana, para o detalhamento semanal.
+    O eixo de sabores começa pelos sabores configurados e ganha os que aparecerem nos dados (ex.: um sabor
+    descontinuado), para que nenhuma venda fique fora dos totais.
+    """
+
+    def __init__(self, sabores):
+        self.sabores = list(sabores)
+        self.primeiro_dia = None
+        self._n_dias = 0
+        self._alocar(0)
+
+    def _alocar(self, capacidade):
+        forma = (capacidade + 1, len(self.sabores), len(METRICAS))
+        acumulado = np.zeros(forma, dtype=np.int64)
+        acumulado_semana = np.zeros((capacidade + 1, 7) + forma[1:], dtype=np.int64)
+        if self._n_dias:
+            acumulado[:self._n_dias + 1] = self._acumulado[:self._n_dias + 1]
+            acumulado_semana[:self._n_dias + 1] = self._acumulado_semana[:self._n_dias + 1]
+        self._acumulado, self._acumulado_semana = acumulado, acumulado_semana
+
+    def _incluir_sabores(self, sabores):
+        """Acrescenta ao eixo de sabores os que ainda não existem, com somas zeradas."""
+        novos = [sabor for sabor in sabores if sabor not in self.sabores]
+        if not novos:
+            return
+        self.sabores.extend(novos)
+        largura = [(0, 0)] * (self._acumulado.ndim - 2) + [(0, len(novos)), (0, 0)]
+        self._acumulado = np.pad(self._acumulado, largura)
+        self._acumulado_semana = np.pad(self._acumulado_semana, [(0, 0)] + largura)
+
+    @property
+    def ultimo_dia(self):
+        if self.primeiro_dia is None or not self._n_dias:
+            return None
+        return self.primeiro_dia + timedelta(days=self._n_dias - 1)
+
+    @classmethod
+    def a_partir_de(cls, df_vendas, df_consumo, sabores=None, timezone=None):
+        """Constrói o índice a partir dos DataFrames de vendas e consumo."""
+        indice = cls(sabores if sabores is not None else config.SABORES_VALIDOS)
+        indice.estender(df_vendas, df_consumo, timezone)
+        return indice
+
+    def _valores_diarios(self, df_vendas, df_consumo, timezone):
+        """Agrupa as linhas por (dia local, sabor) e devolve {dia: array (sabores x métricas)}."""
+        timezone = timezone or config.TIMEZONE
+        valores = {}
+
+        def agrupar(df, colunas):
+            if df.empty:
+                return None
+            dias = df['data_hora'].dt.tz_convert(timezone).dt.date
+            sabores = df['sabor'].astype(object).fillna(SABOR_OUTROS)
+            return df.groupby([dias, sabores])[list(colunas.values())].sum()
+
+        colunas_vendas = {_FATURAMENTO: 'total_venda', _LUCRO: 'lucro_venda', _QUANTIDADE: 'quantidade'}
+        colunas_consumo = {_CUSTO_CONSUMO: 'custo_total'}
+        agrupados = [(agrupar(df_vendas, colunas_vendas), colunas_vendas),
+                     (agrupar(df_consumo, colunas_consumo), colunas_consumo)]
+        for agrupado, _ in agrupados:
+            if agrupado is not None:
+                self._incluir_sabores(agrupado.index.get_level_values(1).unique())
+        sabor_idx = {sabor: i for i, sabor in enumerate(self.sabores)}
+
+        for agrupado, colunas in agrupados:
+            if agrupado is None:
+                continue
+            for (dia, sabor), linha in agrupado.iterrows():
+                destino = valores.setdefault(dia, np.zeros((len(self.sabores), len(METRICAS)), dtype=np.int64))
+                for metrica, coluna in colunas.items():
+                    destino[sabor_idx[sabor], metrica] += linha[coluna]
+        return valores
+
+    def estender(self, df_vendas, df_consumo, timezone=None):
+        """
+        Acrescenta ao índice os dias presentes nos DataFrames, que devem ser posteriores ao último dia indexado.
+        O custo é proporcional às linhas novas, não ao histórico.
+        """
+        valores = self._valores_diarios(df_vendas, df_consumo, timezone)
+        if not valores:
+            return
+        dias = sorted(valores)
+        if self.ultimo_dia is not None and dias[0] <= self.ultimo_dia:
+            raise ValueError(f"O índice já cobre até {self.ultimo_dia}; use truncar() antes de reprocessar {dias[0]}.")
+        if self.primeiro_dia is None:
+            self.primeiro_dia = dias[0]
+
+        n_total = (dias[-1] - self.primeiro_dia).days + 1
+        if n_total + 1 > len(self._acumulado):
+            self._alocar(max(n_total, 2 * len(self._acumulado)))
+
+        inicio = self._n_dias
+        novos = np.zeros((n_total - inicio, len(self.sabores), len(METRICAS)), dtype=np.int64)
+        novos_semana = np.zeros((n_total - inicio, 7, len(self.sabores), len(METRICAS)), dtype=np.int64)
+        for dia, valor in valores.items():
+            i = (dia - self.primeiro_dia).days - inicio
+            novos[i] = valor
+            novos_semana[i, dia.weekday()] = valor
+
+        self._acumulado[inicio + 1:n_total + 1] = self._acumulado[inicio] + np.cumsum(novos, axis=0)
+        self._acumulado_semana[inicio + 1:n_total + 1] = self._acumulado_semana[inicio] + np.cumsum(novos_semana, axis=0)
+        self._n_dias = n_total
+
+    def truncar(self, dia):
+        """Descarta os dias a partir de `dia` (inclusive), para que possam ser reprocessados."""
+        if self.primeiro_dia is None:
+            return
+        self._n_dias = max(0, min(self._n_dias, (dia - self.primeiro_dia).days))
+        if not self._n_dias:
+            self.primeiro_dia = None
+
+    def _intervalo(self, inicio, fim):
+        """Converte datas em índices [i, j) do array acumulado, limitados ao período indexado."""
+        if self.primeiro_dia is None:
+            return 0, 0
+        i = min(max((inicio - self.primeiro_dia).days, 0), self._n_dias)
+        j = min(max((fim - self.primeiro_dia).days + 1, 0), self._n_dias)
+        return i, max(i, j)
+
+    def _selecionar_sabor(self, array, sabor):
+        if sabor is None:
+            return array.sum(axis=-2)
+        return array[..., self.sabores.index(sabor), :]
+
+    def totais(self, inicio, fim, sabor=None):
+        """Retorna {métrica: total} entre as datas `inicio` e `fim` (inclusive), opcionalmente para um só sabor."""
+        i, j = self._intervalo(inicio, fim)
+        total = self._selecionar_sabor(self._acumulado[j] - self._acumulado[i], sabor)
+        return dict(zip(METRICAS, total.tolist()))
+
+    def por_dia_da_semana(self, inicio, fim, sabor=None):
+        """Retorna uma lista com {métrica: total} para cada dia da semana (segunda a domingo) no intervalo."""
+        i, j = self._intervalo(inicio, fim)
+        totais = self._selecionar_sabor(self._acumulado_semana[j] - self._acumulado_semana[i], sabor)
+        return [dict(zip(METRICAS, linha.tolist())) for linha in totais]
+
+
+# Índices mantidos entre comandos, um por tenant (no máximo config.MAX_INDICES_LUCRO, descartando o usado há
+# mais tempo). Cada um só é atualizado quando os arquivos de vendas ou consumo do tenant mudam no Drive ou
+# quando muda o conjunto de registros do journal ainda não aplicados, que também entram no índice.
+# Os dias anteriores a `reabrir` estão fechados e não são reprocessados; o dia corrente (e o dia de registros
+# que ainda estavam no journal) é refeito a cada mudança.
+# _trava_cache só protege o dicionário; downloads e reconstruções usam a trava do próprio tenant, para que o
+# /lucro de uma barraca não espere pelo Drive de outra.
+_caches = OrderedDict()
+_trava_cache = threading.Lock()
+
+
+# Colunas lidas do Drive para montar o índice
+COLUNAS_VENDAS = ['data_hora', 'sabor', 'quantidade', 'total_venda', 'lucro_venda', 'id_registro']
+COLUNAS_CONSUMO = ['data_hora', 'sabor', 'custo_total', 'id_registro']
+
+def _primeiro_dia_pendente(df, pendentes, timezone):
+    """Dia local mais antigo entre as linhas do DataFrame que vieram do journal, ou None."""
+    if 'id_registro' not in df.columns:
+        return None
+    dias = df.loc[df['id_registro'].isin(pendentes), 'data_hora'].dt.tz_convert(timezone).dt.date
+    return dias.min() if not dias.empty else None
+
+def obter_indice(tenant, service=None):
+    """
+    Retorna o índice de lucro do tenant atualizado, baixando vendas e consumo só quando houve alteração no Drive.
+    Inclui as vendas e consumos confirmados no journal que ainda não chegaram ao Drive.
+    """
+    if service is None:
+        service = drive.get_drive_service()
+    file_ids = drive.get_file_ids(service, [config.DRIVE_VENDAS_FILE, config.DRIVE_CONSUMO_FILE], tenant.folder_id)
+    versoes = tuple(drive.versao_arquivo(file_ids[nome]) for nome in (config.DRIVE_VENDAS_FILE,
+                                                                        config.DRIVE_CONSUMO_FILE))
+    pendentes = journal.ids_pendentes(tenant)
+    with _trava_cache:
+        cache = _caches.pop(tenant.id, None) or {'trava': threading.Lock(), 'versoes': None, 'pendentes': None,
+                                                 'hoje': None, 'reabrir': None, 'indice': None}
+        _caches[tenant.id] = cache
+        while len(_caches) > config.MAX_INDICES_LUCRO:
+            _caches.popitem(last=False)
+
+    with cache['trava']:
+        hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+        indice = cache['indice']
+        if (indice is not None and cache['versoes'] == versoes and cache['pendentes'] == pendentes
+                and cache['hoje'] == hoje):
+            return indice
+
+        df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, file_ids[config.DRIVE_VENDAS_FILE],
+                                             COLUNAS_VENDAS, colunas=COLUNAS_VENDAS, preco_custo=tenant.preco_custo)
+        df_consumo = drive.download_dataframe(service, config.DRIVE_CONSUMO_FILE, file_ids[config.DRIVE_CONSUMO_FILE],
+                                              COLUNAS_CONSUMO, colunas=COLUNAS_CONSUMO)
+        df_vendas = journal.com_pendentes(df_vendas, tenant, config.DRIVE_VENDAS_FILE)
+        df_consumo = journal.com_pendentes(df_consumo, tenant, config.DRIVE_CONSUMO_FILE)
+        # Registros do journal podem ser de dias anteriores (ex.: Drive fora do ar na virada do dia); esses dias
+        # são reabertos na próxima atualização, quando os registros já estiverem no Drive
+        reabrir = min([hoje] + [dia for dia in (_primeiro_dia_pendente(df_vendas, pendentes, tenant.timezone),
+                                                _primeiro_dia_pendente(df_consumo, pendentes, tenant.timezone))
+                                if dia is not None])
+
+        if indice is None or not set(tenant.sabores) <= set(indice.sabores):
+            # Reconstrução completa: inclui o histórico já arquivado
+            df_vendas = arquivamento.carregar_historico(service, tenant, config.DRIVE_VENDAS_FILE, df_vendas)
+            df_consumo = arquivamento.carregar_historico(service, tenant, config.DRIVE_CONSUMO_FILE, df_consumo)
+            indice = IndiceLucro.a_partir_de(df_vendas, df_consumo, tenant.sabores, tenant.timezone)
+        else:
+            # Reprocessa só a partir do primeiro dia que ainda estava aberto na atualização anterior
+            desde = min(cache['reabrir'], reabrir)
+            indice.truncar(desde)
+            vendas_dia = df_vendas['data_hora'].dt.tz_convert(tenant.timezone).dt.date
+            consumo_dia = df_consumo['data_hora'].dt.tz_convert(tenant.timezone).dt.date
+            indice.estender(df_vendas[vendas_dia >= desde], df_consumo[consumo_dia >= desde], tenant.timezone)
+
+        cache.update(versoes=versoes, pendentes=pendentes, hoje=hoje, reabrir=reabrir, indice=indice)
+        return indice
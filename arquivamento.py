@@ -0,0 +1,127 @@
+# arquivamento.py
+
+"""
+Arquivamento do histórico frio.
+
+Vendas, consumo e estoque de dias já fechados (presentes em historico_fechamentos.csv) e mais antigos que
+config.ARQUIVAMENTO_DIAS saem dos CSVs do dia a dia e vão para arquivos anuais comprimidos na mesma pasta
+do tenant (ex.: vendas_pasteis_2024.csv.gz). Assim /venda, /consumo e /ver_estoque só baixam o período recente.
+Relatórios de períodos longos usam carregar_historico, que junta os arquivos mortos ao arquivo quente.
+"""
+
+import asyncio
+import os
+from datetime import timedelta
+
+import pandas as pd
+
+import concorrencia
+import config
+import google_drive as drive
+import schema
+
+# Arquivos arquivados e a coluna que define o dia de cada linha
+COLUNA_DATA = {
+    config.DRIVE_VENDAS_FILE: 'data_hora',
+    config.DRIVE_CONSUMO_FILE: 'data_hora',
+    config.DRIVE_ESTOQUE_FILE: 'data',
+}
+
+def nome_arquivo_morto(arquivo, ano):
+    """Nome do arquivo anual comprimido, ex.: vendas_pasteis.csv -> vendas_pasteis_2024.csv.gz."""
+    base, extensao = os.path.splitext(arquivo)
+    return f"{base}_{ano}{extensao}.gz"
+
+def limite_arquivamento(tenant):
+    """Primeiro dia que sempre permanece no arquivo quente do tenant."""
+    return pd.Timestamp.now(tz=tenant.timezone).date() - timedelta(days=config.ARQUIVAMENTO_DIAS)
+
+def _dias(df, arquivo, tenant):
+    """Dia (no fuso do tenant) de cada linha. O estoque já é gravado por data."""
+    coluna = df[COLUNA_DATA[arquivo]]
+    if arquivo != config.DRIVE_ESTOQUE_FILE:
+        coluna = coluna.dt.tz_convert(tenant.timezone)
+    return coluna.dt.date
+
+def carregar_historico(service, tenant, arquivo, df_quente, desde=None):
+    """
+    Junta ao DataFrame do arquivo quente as linhas arquivadas a partir do ano de `desde` (todas, se None).
+    Se `desde` ainda está dentro da janela quente, retorna o DataFrame sem consultar o Drive.
+    Dias presentes nos dois (arquivamento interrompido, ver _arquivar_arquivo) vêm só do arquivo quente.
+    """
+    limite = limite_arquivamento(tenant)
+    if desde is not None and desde >= limite:
+        return df_quente
+
+    primeiro_ano = max(desde.year, config.ARQUIVAMENTO_ANO_INICIAL) if desde else config.ARQUIVAMENTO_ANO_INICIAL
+    nomes = [nome_arquivo_morto(arquivo, ano) for ano in range(primeiro_ano, limite.year + 1)]
+    file_ids = drive.get_file_ids(service, nomes, tenant.folder_id)
+    colunas = list(df_quente.columns)
+    partes = [drive.download_dataframe(service, arquivo, file_ids[nome], colunas, comprimido=True, colunas=colunas,
+                                       preco_custo=tenant.preco_custo)
+              for nome in nomes if file_ids[nome]]
+    if not partes:
+        return df_quente
+    dias_quentes = set(_dias(df_quente, arquivo, tenant))
+    partes = [parte[~_dias(parte, arquivo, tenant).isin(dias_quentes)] for parte in partes]
+    df = pd.concat(partes + [df_quente], ignore_index=True)
+    # Partes já estão no esquema compacto; só o sabor perde o tipo categoria ao juntar categorias diferentes
+    if 'sabor' in df.columns:
+        df['sabor'] = df['sabor'].astype('category')
+    return df
+
+def _dias_fechados(service, tenant):
+    """Dias que já constam no histórico de fechamentos do tenant (síncrona)."""
+    fechamentos_fid = drive.get_file_id(service, config.DRIVE_FECHAMENTOS_FILE, tenant.folder_id)
+    df_fechamentos = drive.download_dataframe(service, config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid, ['data'],
+                                              colunas=['data'])
+    return set(df_fechamentos['data'].dt.date)
+
+def _arquivar_arquivo(service, tenant, arquivo, dias_fechados, limite):
+    """
+    Move para os arquivos mortos as linhas de dias fechados anteriores ao limite (síncrona).
+    Cada dia é movido inteiro, e os arquivos mortos são gravados antes do arquivo quente. Se o processo cair no
+    meio, o arquivo quente ainda traz os dias já gravados no arquivo morto; na próxima execução esses dias só saem
+    do arquivo quente, sem serem acrescentados de novo. Linhas idênticas de um mesmo dia (ex.: duas vendas iguais
+    no mesmo segundo) são mantidas.
+    Retorna quantas linhas foram movidas.
+    """
+    file_id = drive.get_file_id(service, arquivo, tenant.folder_id)
+    if not file_id:
+        return 0
+    df = drive.download_dataframe(service, arquivo, file_id, list(schema.SCHEMAS[arquivo]),
+                                  preco_custo=tenant.preco_custo)
+    dias = _dias(df, arquivo, tenant)
+    mover = (dias < limite) & dias.isin(dias_fechados)
+    if not mover.any():
+        return 0
+
+    anos = dias.map(lambda dia: dia.year)
+    nomes = {ano: nome_arquivo_morto(arquivo, ano) for ano in anos[mover].unique()}
+    ids_mortos = drive.get_file_ids(service, list(nomes.values()), tenant.folder_id)
+    for ano, nome in nomes.items():
+        existente = drive.download_dataframe(service, arquivo, ids_mortos[nome], list(df.columns), comprimido=True)
+        ja_arquivados = set(_dias(existente, arquivo, tenant))
+        novos = mover & (anos == ano) & ~dias.isin(ja_arquivados)
+        if not novos.any():
+            continue
+        df_ano = pd.concat([existente, df[novos]], ignore_index=True)
+        drive.upload_dataframe(service, df_ano, arquivo, ids_mortos[nome], tenant.folder_id, nome_no_drive=nome)
+
+    drive.upload_dataframe(service, df[~mover], arquivo, file_id, tenant.folder_id)
+    return int(mover.sum())
+
+async def arquivar_tenant(tenant):
+    """
+    Arquiva o histórico frio do tenant, um arquivo por vez e com a trava do arquivo, para não competir
+    com /venda, /consumo ou com o journal. Retorna {arquivo: linhas movidas}.
+    """
+    service = await asyncio.to_thread(drive.get_drive_service)
+    limite = limite_arquivamento(tenant)
+    dias_fechados = await asyncio.to_thread(_dias_fechados, service, tenant)
+    movidas = {}
+    for arquivo in COLUNA_DATA:
+        async with concorrencia.travar_arquivos(tenant.id, arquivo):
+            movidas[arquivo] = await asyncio.to_thread(_arquivar_arquivo, service, tenant, arquivo,
+                                                       dias_fechados, limite)
+    return movidas
@@ -0,0 +1,82 @@
+# concorrencia.py
+
+"""
+Processamento concorrente de updates com ordem garantida por chat e travas por arquivo do Drive.
+
+- ProcessadorPorChat: updates de chats diferentes rodam em paralelo (até o limite configurado);
+  updates do mesmo chat rodam um de cada vez, na ordem de chegada. Isso mantém o ConversationHandler
+  do /fechamento consistente.
+- travar_arquivos: serializa leituras-e-escritas sobre os mesmos arquivos de um tenant (ex.: checagem de
+  estoque seguida de registro em /venda), sem bloquear comandos que mexem em outros arquivos ou tenants.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class _TravasNomeadas:
+    """Dicionário de asyncio.Lock criado sob demanda e liberado quando ninguém mais usa a chave."""
+
+    def __init__(self):
+        self._travas = {}
+        self._usuarios = {}
+
+    @asynccontextmanager
+    async def travar(self, chave):
+        trava = self._travas.setdefault(chave, asyncio.Lock())
+        self._usuarios[chave] = self._usuarios.get(chave, 0) + 1
+        try:
+            async with trava:
+                yield
+        finally:
+            self._usuarios[chave] -= 1
+            if not self._usuarios[chave]:
+                del self._usuarios[chave]
+                del self._travas[chave]
+
+class ProcessadorPorChat(BaseUpdateProcessor):
+    """
+    Processa updates concorrentemente, mas em ordem dentro de cada chat.
+    Updates sem chat (ex.: inline queries) não são serializados.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._travas_chat = _TravasNomeadas()
+
+    async def process_update(self, update, coroutine) -> None:
+        # A trava do chat vem antes da vaga de concorrência (o semáforo da classe base, em super().process_update):
+        # updates na fila de um chat lento esperam sem ocupar vagas, e os outros chats seguem sendo atendidos.
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+        async with self._travas_chat.travar(chat.id):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+_travas_arquivos = _TravasNomeadas()
+
+@asynccontextmanager
+async def travar_arquivos(tenant_id, *nomes):
+    """
+    Trava os arquivos indicados do tenant durante um ciclo de leitura, validação e escrita.
+    As travas são adquiridas sempre em ordem alfabética, para evitar deadlock entre comandos.
+    """
+    nomes = sorted(set(nomes))
+    if not nomes:
+        yield
+        return
+    async with _travas_arquivos.travar((tenant_id, nomes[0])):
+        async with travar_arquivos(tenant_id, *nomes[1:]):
+            yield
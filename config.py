@@ -18,12 +18,53 @@ TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 DRIVE_FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID", "")
 
+# --- MODO DE EXECUÇÃO ---
+# "polling" (padrão) ou "webhook". No modo webhook o bot sobe um servidor HTTP próprio na porta PORT
+# e o Telegram envia as atualizações para WEBHOOK_URL + WEBHOOK_PATH. WEBHOOK_SECRET é obrigatório nesse modo.
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+PORT = int(os.environ.get("PORT", "8080"))
+
+# Quantos updates podem ser processados ao mesmo tempo (chats diferentes). Use 1 para processamento sequencial.
+MAX_UPDATES_CONCORRENTES = int(os.environ.get("MAX_UPDATES_CONCORRENTES", "8"))
+
+# --- MULTI-TENANT (várias barracas no mesmo processo) ---
+# Registro de tenants em JSON (variável TENANTS_JSON ou arquivo TENANTS_FILE); ver tenants.py.
+# Sem registro, o bot atende uma única barraca com as configurações deste arquivo.
+TENANTS_JSON = os.environ.get("TENANTS_JSON", "")
+TENANTS_FILE = os.environ.get("TENANTS_FILE", "tenants.json")
+
+# Quantos arquivos podem ser baixados do Drive ao mesmo tempo (ver google_drive.download_dataframes)
+MAX_DOWNLOADS_SIMULTANEOS = int(os.environ.get("MAX_DOWNLOADS_SIMULTANEOS", "8"))
+
+# Limites de memória dos caches, por tenant
+CACHE_MAX_BYTES_POR_TENANT = int(os.environ.get("CACHE_MAX_BYTES_POR_TENANT", str(8 * 1024 * 1024)))
+MAX_INDICES_LUCRO = int(os.environ.get("MAX_INDICES_LUCRO", "32"))
+
 # --- NOMES DOS ARQUIVOS NO DRIVE ---
 DRIVE_VENDAS_FILE = "vendas_pasteis.csv"
 DRIVE_ESTOQUE_FILE = "estoque_diario.csv"
 DRIVE_CONSUMO_FILE = "consumo_pessoal.csv"
 DRIVE_FECHAMENTOS_FILE = "historico_fechamentos.csv"
 
+# --- JOURNAL LOCAL (vendas e consumos confirmados antes do upload ao Drive) ---
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", "journal_movimentos.jsonl")
+JOURNAL_ESPERA_MAXIMA = 60  # segundos entre novas tentativas quando o Drive está fora
+
+# --- ARQUIVAMENTO DO HISTÓRICO (ver arquivamento.py) ---
+# Dias fechados mais antigos que ARQUIVAMENTO_DIAS saem dos CSVs do dia a dia e vão para arquivos anuais .csv.gz.
+# Reduzir o valor é seguro; aumentá-lo não traz de volta linhas já arquivadas.
+ARQUIVAMENTO_DIAS = int(os.environ.get("ARQUIVAMENTO_DIAS", "90"))
+ARQUIVAMENTO_HORA = 3  # horário diário do job, no fuso de cada tenant
+ARQUIVAMENTO_ANO_INICIAL = 2020  # primeiro ano procurado ao ler os arquivos mortos
+
+# --- ADMINISTRAÇÃO ---
+# IDs de usuário do Telegram (separados por vírgula) que podem usar comandos de diagnóstico como /profile
+ADMIN_USER_IDS = {int(uid) for uid in os.environ.get("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+PERFIS_DIR = os.environ.get("PERFIS_DIR", "perfis")  # onde os perfis (.prof) do /profile são salvos
+
 # --- CONFIGURAÇÕES DO NEGÓCIO ---
 PRECO_FIXO_VENDA = 10.00
 PRECO_FIXO_CUSTO = 4.50
@@ -11,7 +11,12 @@ import pandas as pd
 import pickle
 import json
 import base64
+import contextvars
+import csv
+import gzip
 import io
+import threading
+from collections import OrderedDict
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -19,20 +24,32 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 
 import config  # Importa nossas configurações
+import perfilamento
+import schema
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-def _empty_dataframe(columns):
+# O motor pyarrow lê CSVs em paralelo e já converte datas ISO nativamente; sem ele, usa o motor C do pandas
+try:
+    import pyarrow  # noqa: F401
+    _MOTOR_CSV = 'pyarrow'
+except ImportError:
+    _MOTOR_CSV = 'c'
+
+def _empty_dataframe(columns, file_name=None):
     """Cria um DataFrame vazio com as colunas especificadas, já convertendo a primeira para datetime se aplicável."""
     df = pd.DataFrame(columns=columns)
     if columns:
         df[columns[0]] = pd.to_datetime(df[columns[0]], utc=True)
-    return df
+    return schema.compactar(df, file_name)
 
-def get_drive_service():
-    """
-    Autentica e retorna um serviço da Google Drive API, utilizando credenciais locais ou variáveis de ambiente.
-    """
+# Credenciais carregadas uma vez e compartilhadas. Com updates concorrentes, várias threads pedem serviços ao
+# mesmo tempo; a trava garante que só uma lê, renova e regrava o token.pickle.
+_credenciais = None
+_trava_credenciais = threading.Lock()
+
+def _carregar_credenciais():
+    """Lê, renova ou obtém as credenciais do Google (chamar com _trava_credenciais)."""
     creds = None
     if os.path.exists('token.pickle'):
         with open('token.pickle', 'rb') as token:
@@ -63,59 +80,290 @@ def get_drive_service():
                 else:
                     raise ValueError("Token ou credenciais não encontrados.")
 
-        with open('token.pickle', 'wb') as token:
+        # Escrita atômica: um token.pickle pela metade invalidaria as credenciais no próximo início
+        with open('token.pickle.tmp', 'wb') as token:
             pickle.dump(creds, token)
+        os.replace('token.pickle.tmp', 'token.pickle')
+
+    return creds
 
+def get_drive_service():
+    """
+    Autentica e retorna um serviço da Google Drive API, utilizando credenciais locais ou variáveis de ambiente.
+    """
+    global _credenciais
+    with _trava_credenciais:
+        if _credenciais is None or not _credenciais.valid:
+            _credenciais = _carregar_credenciais()
+        creds = _credenciais
     return build('drive', 'v3', credentials=creds)
 
+class _CachePasta:
+    """
+    Cache de uma pasta do Drive (um tenant): versão mais recente vista de cada arquivo e o conteúdo já baixado.
+    O conteúdo é limitado em bytes e descarta primeiro o arquivo usado há mais tempo.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.versoes = {}
+        self._conteudo = OrderedDict()
+        self._bytes = 0
+        self._trava = threading.Lock()
+
+    def obter(self, file_id):
+        """Retorna o conteúdo em cache se ainda corresponde à última versão vista, senão None."""
+        with self._trava:
+            versao = self.versoes.get(file_id)
+            item = self._conteudo.get(file_id)
+            if not versao or not item or item[0] != versao:
+                return None
+            self._conteudo.move_to_end(file_id)
+            return item[1]
+
+    def guardar(self, file_id, versao, conteudo, enviado=False):
+        """
+        Guarda o conteúdo de `versao` do arquivo. Um download só é guardado se `versao` ainda é a última vista:
+        se outra consulta de metadados já viu uma versão mais nova durante o download, o conteúdo é descartado.
+        Com `enviado` (o conteúdo acabou de ser enviado por nós), `versao` passa a ser a última vista.
+        """
+        with self._trava:
+            if enviado:
+                self.versoes[file_id] = versao
+            elif self.versoes.get(file_id) != versao:
+                return
+            antigo = self._conteudo.pop(file_id, None)
+            if antigo:
+                self._bytes -= len(antigo[1])
+            if not versao or len(conteudo) > self.max_bytes:
+                return
+            self._conteudo[file_id] = (versao, conteudo)
+            self._bytes += len(conteudo)
+            while self._bytes > self.max_bytes:
+                _, (_, descartado) = self._conteudo.popitem(last=False)
+                self._bytes -= len(descartado)
+
+# Um cache por pasta do Drive (ou seja, por tenant). Toda consulta de metadados atualiza as versões
+# conhecidas; o download só é refeito se a versão mudou.
+_caches = {}
+_pasta_do_arquivo = {}
+_nome_do_arquivo = {}  # só para identificar as chamadas na linha do tempo do perfilamento
+_trava_caches = threading.Lock()
+
+def _cache_da_pasta(folder_id):
+    with _trava_caches:
+        if folder_id not in _caches:
+            _caches[folder_id] = _CachePasta(config.CACHE_MAX_BYTES_POR_TENANT)
+        return _caches[folder_id]
+
+def _cache_do_arquivo(file_id):
+    return _cache_da_pasta(_pasta_do_arquivo.get(file_id, ''))
+
+def _versao(arquivo):
+    """Extrai o identificador de versão de um item retornado pela API (md5 ou data de modificação)."""
+    return arquivo.get('md5Checksum') or arquivo.get('modifiedTime')
+
+def versao_arquivo(file_id):
+    """Retorna a versão do arquivo vista na última consulta de metadados (None se desconhecida)."""
+    return _cache_do_arquivo(file_id).versoes.get(file_id) if file_id else None
+
+def get_files_metadata(service, file_names, folder_id):
+    """
+    Resolve vários arquivos da pasta numa única chamada files().list.
+    Retorna {nome: {'id', 'name', 'md5Checksum', 'modifiedTime'}}; arquivos inexistentes ficam de fora.
+    """
+    nomes = list(dict.fromkeys(file_names))
+    if not nomes:
+        return {}
+    filtro_nomes = " or ".join(f"name='{nome}'" for nome in nomes)
+    query = f"({filtro_nomes}) and trashed=false"
+    if folder_id: query += f" and '{folder_id}' in parents"
+
+    cache = _cache_da_pasta(folder_id)
+    metadados = {}
+    page_token = None
+    while True:
+        with perfilamento.chamada_drive(f"list {', '.join(nomes)}"):
+            response = service.files().list(
+                q=query, spaces='drive', pageToken=page_token,
+                fields='nextPageToken, files(id, name, md5Checksum, modifiedTime)').execute()
+        for arquivo in response.get('files', []):
+            if arquivo['name'] not in metadados:
+                metadados[arquivo['name']] = arquivo
+                _pasta_do_arquivo[arquivo['id']] = folder_id
+                _nome_do_arquivo[arquivo['id']] = arquivo['name']
+                cache.versoes[arquivo['id']] = _versao(arquivo)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return metadados
+
+def get_file_ids(service, file_names, folder_id):
+    """
+    Retorna {nome: ID ou None} para todos os arquivos pedidos, com um único round trip ao Drive.
+    """
+    metadados = get_files_metadata(service, file_names, folder_id)
+    return {nome: metadados[nome]['id'] if nome in metadados else None for nome in file_names}
+
 def get_file_id(service, file_name, folder_id):
     """
     Retorna o ID do arquivo no Drive pelo nome e pasta.
     """
-    query = f"name='{file_name}' and trashed=false"
-    if folder_id: query += f" and '{folder_id}' in parents"
-    response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-    files = response.get('files', [])
-    return files[0]['id'] if files else None
+    return get_file_ids(service, [file_name], folder_id)[file_name]
 
-def download_dataframe(service, file_name, file_id, default_cols):
+def download_bytes(service, file_id):
     """
-    Baixa um arquivo CSV do Drive e retorna como DataFrame.
-    Se não existir, retorna DataFrame vazio com as colunas padrão.
+    Baixa o conteúdo bruto de um arquivo do Drive.
+    Reaproveita o cache local quando a última consulta de metadados indica que o arquivo não mudou.
     """
-    if not file_id:
-        return _empty_dataframe(default_cols)
+    cache = _cache_do_arquivo(file_id)
+    nome = _nome_do_arquivo.get(file_id, file_id)
+    em_cache = cache.obter(file_id)
+    if em_cache is not None:
+        with perfilamento.chamada_drive(f"download {nome} (cache)"):
+            return em_cache
+    versao = cache.versoes.get(file_id)
 
     request = service.files().get_media(fileId=file_id)
     fh = io.BytesIO()
     downloader = MediaIoBaseDownload(fh, request)
     done = False
-    while not done: status, done = downloader.next_chunk()
-    fh.seek(0)
+    with perfilamento.chamada_drive(f"download {nome}"):
+        while not done: status, done = downloader.next_chunk()
+    conteudo = fh.getvalue()
+    cache.guardar(file_id, versao, conteudo)
+    return conteudo
+
+def _cabecalho(conteudo):
+    """Nomes das colunas de um CSV, lidos só da primeira linha."""
+    primeira_linha = conteudo.split(b'\n', 1)[0].decode('utf-8-sig').strip()
+    return next(csv.reader([primeira_linha])) if primeira_linha else []
+
+def _completar_vendas_legado(df, preco_custo):
+    """Calcula custo_unidade e lucro_venda (em reais) para vendas gravadas antes dessas colunas existirem."""
+    df['custo_unidade'] = preco_custo
+    df['lucro_venda'] = df['total_venda'] - (df['quantidade'].fillna(0) * preco_custo)
+    return df
+
+def _ler_csv(conteudo, file_name, colunas=None):
+    """
+    Lê o CSV já com os tipos do esquema, apenas com as colunas pedidas (todas, se None).
+    Retorna o DataFrame com as datas convertidas, mas dinheiro ainda em reais.
+    """
+    usar = [coluna for coluna in _cabecalho(conteudo) if colunas is None or coluna in colunas]
+    df = pd.read_csv(io.BytesIO(conteudo), usecols=usar, dtype=schema.tipos_leitura(file_name, usar),
+                     engine=_MOTOR_CSV)
+    for coluna in schema.colunas_de_data(file_name, usar):
+        df[coluna] = pd.to_datetime(df[coluna], utc=True, format='ISO8601')
+    return df
+
+def download_dataframe(service, file_name, file_id, default_cols, comprimido=False, colunas=None, preco_custo=None):
+    """
+    Baixa um arquivo CSV do Drive e retorna como DataFrame no esquema compacto (ver schema.py).
+    `file_name` define o esquema; com `comprimido`, o conteúdo é um CSV em gzip (ver arquivamento.py).
+    `colunas` limita a leitura às colunas necessárias; use None (todas) quando o DataFrame for enviado
+    de volta ao Drive, para não perder colunas.
+    `preco_custo` é o custo unitário do tenant, usado para completar vendas ainda não migradas
+    (config.PRECO_FIXO_CUSTO, se None).
+    Se não existir, retorna DataFrame vazio com as colunas padrão.
+    """
+    if not file_id:
+        return _empty_dataframe(colunas or default_cols, file_name)
+
+    conteudo = download_bytes(service, file_id)
+    if comprimido:
+        conteudo = gzip.decompress(conteudo)
+    if not conteudo.strip():
+        return _empty_dataframe(colunas or default_cols, file_name)
 
     try:
-        df = pd.read_csv(fh)
+        if file_name == config.DRIVE_VENDAS_FILE and 'lucro_venda' not in _cabecalho(conteudo):
+            # Arquivo ainda não migrado (ver migrar_vendas_legado): lê tudo e completa em memória
+            custo = config.PRECO_FIXO_CUSTO if preco_custo is None else preco_custo
+            df = _completar_vendas_legado(_ler_csv(conteudo, file_name), custo)
+            if colunas is not None:
+                df = df[[coluna for coluna in df.columns if coluna in colunas]]
+        else:
+            df = _ler_csv(conteudo, file_name, colunas)
         if df.empty:
-            return _empty_dataframe(default_cols)
-        df[df.columns[0]] = pd.to_datetime(df[df.columns[0]], utc=True)
-        if file_name == config.DRIVE_VENDAS_FILE and 'lucro_venda' not in df.columns:
-            df['custo_unidade'] = config.PRECO_FIXO_CUSTO
-            df['lucro_venda'] = df['total_venda'] - (df['quantidade'] * config.PRECO_FIXO_CUSTO)
-        return df
+            return _empty_dataframe(colunas or default_cols, file_name)
+        return schema.compactar(df, file_name)
     except (pd.errors.EmptyDataError, KeyError, IndexError):
-        return _empty_dataframe(default_cols)
+        return _empty_dataframe(colunas or default_cols, file_name)
+
+# Pool dos downloads simultâneos. O googleapiclient não é thread-safe, então cada thread do pool usa seu
+# próprio serviço, criado na primeira vez que a thread baixa algo.
+_pool_downloads = perfilamento.ExecutorPerfilado(max_workers=config.MAX_DOWNLOADS_SIMULTANEOS,
+                                                 thread_name_prefix='drive')
+_servico_local = threading.local()
 
-def upload_dataframe(service, df, file_name, file_id, folder_id):
+def _servico_da_thread():
+    if getattr(_servico_local, 'service', None) is None:
+        _servico_local.service = get_drive_service()
+    return _servico_local.service
+
+def download_dataframes(file_ids, arquivos, preco_custo=None):
+    """
+    Baixa vários arquivos ao mesmo tempo e converte cada um assim que seus bytes chegam.
+    `file_ids` vem de get_file_ids; `arquivos` é {nome: colunas lidas (e colunas do DataFrame vazio)};
+    `preco_custo` segue para download_dataframe.
+    Retorna {nome: DataFrame}. O tempo total fica próximo ao do maior download, e não à soma deles.
+    """
+    def baixar(nome, colunas):
+        return download_dataframe(_servico_da_thread(), nome, file_ids[nome], colunas, colunas=colunas,
+                                  preco_custo=preco_custo)
+
+    # Cada tarefa leva o contexto de quem pediu (ex.: a sessão do /profile)
+    futuros = {nome: _pool_downloads.submit(contextvars.copy_context().run, baixar, nome, colunas)
+               for nome, colunas in arquivos.items()}
+    return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+def migrar_vendas_legado(service, folder_id, preco_custo):
+    """
+    Grava de vez no Drive as colunas custo_unidade e lucro_venda de um CSV de vendas antigo, para que as
+    leituras seguintes não precisem recalculá-las. Síncrona; chamar com a trava do arquivo de vendas.
+    Retorna True se o arquivo foi migrado.
+    """
+    file_id = get_file_id(service, config.DRIVE_VENDAS_FILE, folder_id)
+    if not file_id:
+        return False
+    conteudo = download_bytes(service, file_id)
+    cabecalho = _cabecalho(conteudo)
+    if not cabecalho or 'lucro_venda' in cabecalho:
+        return False
+    df = _completar_vendas_legado(_ler_csv(conteudo, config.DRIVE_VENDAS_FILE), preco_custo)
+    upload_dataframe(service, schema.compactar(df, config.DRIVE_VENDAS_FILE), config.DRIVE_VENDAS_FILE,
+                     file_id, folder_id)
+    return True
+
+def upload_dataframe(service, df, file_name, file_id, folder_id, nome_no_drive=None):
     """
     Envia um DataFrame para o Drive, sobrescrevendo ou criando o arquivo.
+    `file_name` define o esquema; `nome_no_drive`, se diferente, é o nome do arquivo criado. Nomes terminados
+    em .gz são gravados como CSV comprimido.
+    Retorna o ID do arquivo.
     """
-    csv_bytes = df.to_csv(index=False).encode('utf-8')
+    nome_no_drive = nome_no_drive or file_name
+    csv_bytes = schema.expandir(df, file_name).to_csv(index=False).encode('utf-8')
+    mimetype = 'text/csv'
+    if nome_no_drive.endswith('.gz'):
+        csv_bytes = gzip.compress(csv_bytes)
+        mimetype = 'application/gzip'
     fh = io.BytesIO(csv_bytes)
-    media = MediaIoBaseUpload(fh, mimetype='text/csv', resumable=True)
-    file_metadata = {'name': file_name}
+    media = MediaIoBaseUpload(fh, mimetype=mimetype, resumable=True)
+    file_metadata = {'name': nome_no_drive}
     if folder_id and not file_id: file_metadata['parents'] = [folder_id]
 
-    if file_id:
-        service.files().update(fileId=file_id, media_body=media).execute()
-    else:
-        service.files().create(body=file_metadata, media_body=media, fields='id').execute()
\ No newline at end of file
+    with perfilamento.chamada_drive(f"upload {nome_no_drive} ({len(csv_bytes)} bytes)"):
+        if file_id:
+            arquivo = service.files().update(fileId=file_id, media_body=media,
+                                             fields='id, md5Checksum, modifiedTime').execute()
+        else:
+            arquivo = service.files().create(body=file_metadata, media_body=media,
+                                             fields='id, md5Checksum, modifiedTime').execute()
+
+    # O que acabamos de enviar já é a versão atual: evita baixar o arquivo de novo na próxima leitura.
+    _pasta_do_arquivo[arquivo['id']] = folder_id
+    _nome_do_arquivo[arquivo['id']] = nome_no_drive
+    _cache_da_pasta(folder_id).guardar(arquivo['id'], _versao(arquivo), csv_bytes, enviado=True)
+    return arquivo['id']
@@ -12,10 +12,32 @@ import json
 from datetime import datetime, timedelta
 import traceback
 import io
+import asyncio
+import itertools
+import threading
 
+import arquivamento
+import concorrencia
 import config
 import google_drive as drive
+import journal
+import perfilamento
 import reports
+import schema
+import tenants
+
+async def _obter_tenant(update: Update):
+    """
+    Retorna o tenant (barraca) que atende o chat. Se o chat não estiver registrado, avisa o usuário e retorna None.
+    """
+    tenant = tenants.do_chat(update.effective_chat.id)
+    if tenant is None:
+        aviso = "⛔ Este chat não está vinculado a nenhuma barraca. Peça ao administrador para registrá-lo."
+        if update.callback_query:
+            await update.callback_query.answer(aviso, show_alert=True)
+        else:
+            await update.message.reply_text(aviso)
+    return tenant
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -41,6 +63,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Relatório completo de hoje.\n"
         "*/lucro [dias]*\n"
         "Lucro acumulado nos últimos dias.\n"
+        "*/lucro [inicio] [fim] [sabor]*\n"
+        "Lucro entre duas datas, opcionalmente por sabor.\n"
+        "*/lucro semanal* | */lucro mensal*\n"
+        "Compara com a semana ou o mês anterior.\n"
+        "*/lucro diasemana [dias]*\n"
+        "Lucro por dia da semana.\n"
         "*/grafico [dias]*\n"
         "Gera um gráfico de desempenho do lucro.\n"
         "*/vendas*\n"
@@ -56,6 +84,14 @@ async def registrar_usuario(update: Update, context: ContextTypes.DEFAULT_TYPE)
     Registra o chat para automação.
     """
     chat_id = update.effective_chat.id
+    if tenants.multi_tenant():
+        tenant = tenants.do_chat(chat_id)
+        situacao = f"vinculado à barraca '{tenant.id}'" if tenant else "ainda não vinculado a nenhuma barraca"
+        await update.message.reply_text(
+            f"Este chat está {situacao}.\n\n"
+            f"Para relatórios automáticos, use este valor em `chats`/`chat_relatorio` no registro de tenants:\n`{chat_id}`"
+        )
+        return
     await update.message.reply_text(
         f"✅ Chat registrado.\n\n"
         f"Para relatórios automáticos, adicione a variável `TELEGRAM_CHAT_ID` no Railway com este valor:\n`{chat_id}`"
@@ -70,35 +106,144 @@ async def definir_estoque(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if not context.args or len(context.args) % 2 != 0:
             await update.message.reply_text("❌ Erro! Formato: `/estoque [sabor1] [qtd1]...`")
             return
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return
 
-        hoje_str = pd.Timestamp.now(tz=config.TIMEZONE).strftime('%Y-%m-%d')
+        hoje_str = pd.Timestamp.now(tz=tenant.timezone).strftime('%Y-%m-%d')
         await update.message.reply_text("Atualizando estoque do dia...")
-        service = drive.get_drive_service()
-
-        estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
-        df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
-                                              ['data', 'sabor', 'quantidade_inicial'])
-        df_estoque['data'] = pd.to_datetime(df_estoque['data']).dt.strftime('%Y-%m-%d')
-
-        resumo_estoque = []
-        for i in range(0, len(context.args), 2):
-            sabor = context.args[i].lower()
-            quantidade = int(context.args[i + 1])
-            if sabor not in config.SABORES_VALIDOS:
-                await update.message.reply_text(f"Sabor '{sabor}' inválido. Ignorando.")
-                continue
-
-            df_estoque = df_estoque[~((df_estoque['data'] == hoje_str) & (df_estoque['sabor'] == sabor))]
-            novo_estoque = pd.DataFrame([{'data': hoje_str, 'sabor': sabor, 'quantidade_inicial': quantidade}])
-            df_estoque = pd.concat([df_estoque, novo_estoque], ignore_index=True)
-            resumo_estoque.append(f"  - {sabor.capitalize()}: {quantidade} unidades")
-
-        drive.upload_dataframe(service, df_estoque, config.DRIVE_ESTOQUE_FILE, estoque_fid, config.DRIVE_FOLDER_ID)
+
+        async with concorrencia.travar_arquivos(tenant.id, config.DRIVE_ESTOQUE_FILE):
+            service = await asyncio.to_thread(drive.get_drive_service)
+            estoque_fid = await asyncio.to_thread(drive.get_file_id, service, config.DRIVE_ESTOQUE_FILE,
+                                                  tenant.folder_id)
+            df_estoque = await asyncio.to_thread(drive.download_dataframe, service, config.DRIVE_ESTOQUE_FILE,
+                                                 estoque_fid, ['data', 'sabor', 'quantidade_inicial'])
+            df_estoque['data'] = pd.to_datetime(df_estoque['data']).dt.strftime('%Y-%m-%d')
+
+            resumo_estoque = []
+            for i in range(0, len(context.args), 2):
+                sabor = context.args[i].lower()
+                quantidade = int(context.args[i + 1])
+                if sabor not in tenant.sabores:
+                    await update.message.reply_text(f"Sabor '{sabor}' inválido. Ignorando.")
+                    continue
+
+                df_estoque = df_estoque[~((df_estoque['data'] == hoje_str) & (df_estoque['sabor'] == sabor))]
+                novo_estoque = pd.DataFrame([{'data': hoje_str, 'sabor': sabor, 'quantidade_inicial': quantidade}])
+                df_estoque = pd.concat([df_estoque, novo_estoque], ignore_index=True)
+                resumo_estoque.append(f"  - {sabor.capitalize()}: {quantidade} unidades")
+
+            await asyncio.to_thread(drive.upload_dataframe, service, df_estoque, config.DRIVE_ESTOQUE_FILE,
+                                    estoque_fid, tenant.folder_id)
+            descartar_retrato(tenant)
         mensagem_resumo = "✅ Estoque inicial de hoje definido:\n" + "\n".join(resumo_estoque)
         await update.message.reply_text(mensagem_resumo)
     except Exception as e:
         await update.message.reply_text(f"🐛 Erro inesperado ao definir estoque: {e}")
 
+# Colunas lidas do Drive nas consultas de estoque. Sem a trava dos arquivos, um registro pode chegar ao Drive
+# (e sair da fila do journal) depois do download: as leituras juntam também os registros do dia já aplicados e
+# incluem `id_registro`, para que journal.com_pendentes não conte duas vezes o que já está no Drive.
+COLUNAS_ESTOQUE = ['data', 'sabor', 'quantidade_inicial']
+COLUNAS_MOVIMENTO = ['data_hora', 'sabor', 'quantidade']
+COLUNAS_MOVIMENTO_SEM_TRAVA = COLUNAS_MOVIMENTO + ['id_registro']
+
+# Arquivos lidos na checagem de estoque: /venda e /consumo travam os três para que duas
+# movimentações simultâneas não vendam o mesmo pastel.
+ARQUIVOS_ESTOQUE = (config.DRIVE_ESTOQUE_FILE, config.DRIVE_VENDAS_FILE, config.DRIVE_CONSUMO_FILE)
+
+class EstoqueNaoDefinido(Exception):
+    """O estoque inicial do dia (ou do sabor) ainda não foi lançado; a mensagem vai direto para o usuário."""
+
+# Retrato local de estoque, vendas e consumo de cada tenant, usado pelo /venda e pelo /consumo para não depender
+# do Drive na hora de responder: {tenant_id: {'geracao': N, 'frames': {arquivo: DataFrame} ou None}}.
+# Junto com o journal (pendentes e aplicados do dia), o retrato cobre todas as movimentações do dia, mesmo
+# que tenha sido baixado antes do upload delas. É atualizado em segundo plano a cada checagem; uma atualização
+# só substitui o retrato se tiver começado depois dele, para que um download lento não traga estoque antigo.
+_retratos = {}
+_geracoes = itertools.count(1)
+_trava_retratos = threading.Lock()
+_atualizacoes = {}
+
+def _baixar_retrato(tenant):
+    """Baixa estoque, vendas e consumo do tenant ao mesmo tempo e guarda como novo retrato (síncrona)."""
+    with _trava_retratos:
+        geracao = next(_geracoes)
+    service = drive.get_drive_service()
+    file_ids = drive.get_file_ids(service, list(ARQUIVOS_ESTOQUE), tenant.folder_id)
+    frames = drive.download_dataframes(file_ids, {config.DRIVE_ESTOQUE_FILE: COLUNAS_ESTOQUE,
+                                                  config.DRIVE_VENDAS_FILE: COLUNAS_MOVIMENTO_SEM_TRAVA,
+                                                  config.DRIVE_CONSUMO_FILE: COLUNAS_MOVIMENTO_SEM_TRAVA},
+                                       preco_custo=tenant.preco_custo)
+    with _trava_retratos:
+        atual = _retratos.get(tenant.id)
+        if atual is None or atual['geracao'] < geracao:
+            _retratos[tenant.id] = {'geracao': geracao, 'frames': frames}
+    return frames
+
+def descartar_retrato(tenant):
+    """Invalida o retrato do tenant após uma gravação de estoque; atualizações já iniciadas são ignoradas."""
+    with _trava_retratos:
+        _retratos[tenant.id] = {'geracao': next(_geracoes), 'frames': None}
+
+def _atualizar_retrato_em_segundo_plano(tenant):
+    """Dispara uma atualização do retrato, se não houver outra em andamento. Falhas só são logadas."""
+    if tenant.id in _atualizacoes:
+        return
+
+    def concluir(tarefa):
+        _atualizacoes.pop(tenant.id, None)
+        if not tarefa.cancelled() and tarefa.exception() is not None:
+            print(f"Retrato de estoque de '{tenant.id}' não atualizado; usando o anterior ({tarefa.exception()}).")
+
+    tarefa = asyncio.ensure_future(asyncio.to_thread(_baixar_retrato, tenant))
+    _atualizacoes[tenant.id] = tarefa
+    tarefa.add_done_callback(concluir)
+
+async def _obter_retrato(tenant):
+    """
+    Retorna o retrato local do tenant e dispara sua atualização em segundo plano. Só espera pelo Drive quando
+    ainda não há retrato (primeira movimentação após o início ou após uma gravação de estoque).
+    """
+    with _trava_retratos:
+        frames = _retratos.get(tenant.id, {}).get('frames')
+    if frames is None:
+        return await asyncio.to_thread(_baixar_retrato, tenant)
+    _atualizar_retrato_em_segundo_plano(tenant)
+    return frames
+
+def _estoque_disponivel(frames, tenant, sabor, hoje):
+    """
+    Calcula quanto resta do sabor no dia a partir do retrato local e do journal (pendentes e aplicados do dia).
+    Retorna o estoque atual.
+    """
+    df_estoque = frames[config.DRIVE_ESTOQUE_FILE]
+    estoque_hoje = df_estoque[df_estoque['data'].dt.date == hoje]
+
+    if estoque_hoje.empty:
+        raise EstoqueNaoDefinido("⚠️ Atenção! Estoque de hoje não definido. Use `/estoque`.")
+
+    estoque_sabor = estoque_hoje[estoque_hoje['sabor'] == sabor]
+    if estoque_sabor.empty:
+        raise EstoqueNaoDefinido(f"⚠️ Atenção! Não há estoque inicial para '{sabor.capitalize()}' hoje.")
+
+    estoque_inicial = estoque_sabor['quantidade_inicial'].iloc[0]
+
+    df_vendas = journal.com_pendentes(frames[config.DRIVE_VENDAS_FILE], tenant, config.DRIVE_VENDAS_FILE,
+                                      incluir_aplicados=True)
+    vendas_hoje_sabor = df_vendas[
+        (df_vendas['data_hora'].dt.tz_convert(tenant.timezone).dt.date == hoje) & (df_vendas['sabor'] == sabor)]
+    ja_vendido = vendas_hoje_sabor['quantidade'].sum()
+
+    df_consumo = journal.com_pendentes(frames[config.DRIVE_CONSUMO_FILE], tenant, config.DRIVE_CONSUMO_FILE,
+                                       incluir_aplicados=True)
+    consumo_hoje_sabor = df_consumo[
+        (df_consumo['data_hora'].dt.tz_convert(tenant.timezone).dt.date == hoje) & (df_consumo['sabor'] == sabor)]
+    ja_consumido = consumo_hoje_sabor['quantidade'].sum()
+
+    return estoque_inicial - ja_vendido - ja_consumido
+
 async def registrar_venda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Registra uma venda de pastel.
@@ -108,61 +253,40 @@ async def registrar_venda(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if len(context.args) != 2: raise ValueError("Formato incorreto")
         sabor = context.args[0].lower()
         quantidade_venda = int(context.args[1])
-        if sabor not in config.SABORES_VALIDOS:
-            sabores_str = ", ".join(config.SABORES_VALIDOS)
-            await update.message.reply_text(f"❌ Sabor inválido. Use: *{sabores_str}*.", parse_mode='Markdown')
-            return
-
-        hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-        service = drive.get_drive_service()
-
-        estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
-        df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
-                                              ['data', 'sabor', 'quantidade_inicial'])
-        estoque_hoje = df_estoque[df_estoque['data'].dt.date == hoje]
-
-        if estoque_hoje.empty:
-            await update.message.reply_text("⚠️ Atenção! Estoque de hoje não definido. Use `/estoque`.")
-            return
-
-        estoque_sabor = estoque_hoje[estoque_hoje['sabor'] == sabor]
-        if estoque_sabor.empty:
-            await update.message.reply_text(f"⚠️ Atenção! Não há estoque inicial para '{sabor.capitalize()}' hoje.")
+        tenant = await _obter_tenant(update)
+        if tenant is None:
             return
-
-        estoque_inicial = estoque_sabor['quantidade_inicial'].iloc[0]
-
-        vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-        df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
-                                             ['data_hora', 'sabor', 'quantidade'])
-        vendas_hoje_sabor = df_vendas[
-            (df_vendas['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje) & (df_vendas['sabor'] == sabor)]
-        ja_vendido = vendas_hoje_sabor['quantidade'].sum()
-
-        consumo_fid = drive.get_file_id(service, config.DRIVE_CONSUMO_FILE, config.DRIVE_FOLDER_ID)
-        colunas_consumo = ['data_hora', 'sabor', 'quantidade', 'custo_total']
-        df_consumo = drive.download_dataframe(service, config.DRIVE_CONSUMO_FILE, consumo_fid, colunas_consumo)
-        consumo_hoje_sabor = df_consumo[
-            (df_consumo['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje) & (df_consumo['sabor'] == sabor)]
-        ja_consumido = consumo_hoje_sabor['quantidade'].sum()
-
-        estoque_atual = estoque_inicial - ja_vendido - ja_consumido
-
-        if quantidade_venda > estoque_atual:
-            await update.message.reply_text(f"❌ Venda não registrada! Estoque insuficiente: *{int(estoque_atual)}*.",
-                                            parse_mode='Markdown')
+        if sabor not in tenant.sabores:
+            sabores_str = ", ".join(tenant.sabores)
+            await update.message.reply_text(f"❌ Sabor inválido. Use: *{sabores_str}*.", parse_mode='Markdown')
             return
 
-        preco_unidade, custo_unidade = config.PRECO_FIXO_VENDA, config.PRECO_FIXO_CUSTO
-        total_venda = quantidade_venda * preco_unidade
-        lucro_venda = total_venda - (quantidade_venda * custo_unidade)
-
-        nova_venda = pd.DataFrame(
-            [{'data_hora': pd.to_datetime('now', utc=True), 'sabor': sabor, 'quantidade': quantidade_venda,
-              'preco_unidade': preco_unidade, 'custo_unidade': custo_unidade, 'total_venda': total_venda,
-              'lucro_venda': lucro_venda}])
-        df_vendas = pd.concat([df_vendas, nova_venda], ignore_index=True)
-        drive.upload_dataframe(service, df_vendas, config.DRIVE_VENDAS_FILE, vendas_fid, config.DRIVE_FOLDER_ID)
+        hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+        async with concorrencia.travar_arquivos(tenant.id, *ARQUIVOS_ESTOQUE):
+            try:
+                frames = await _obter_retrato(tenant)
+                estoque_atual = await asyncio.to_thread(_estoque_disponivel, frames, tenant, sabor, hoje)
+            except EstoqueNaoDefinido as e:
+                await update.message.reply_text(str(e))
+                return
+
+            if quantidade_venda > estoque_atual:
+                await update.message.reply_text(
+                    f"❌ Venda não registrada! Estoque insuficiente: *{int(estoque_atual)}*.", parse_mode='Markdown')
+                return
+
+            # Valores monetários em centavos, como no esquema compacto
+            preco_unidade = schema.para_centavos(tenant.preco_venda)
+            custo_unidade = schema.para_centavos(tenant.preco_custo)
+            total_venda = quantidade_venda * preco_unidade
+            lucro_venda = total_venda - (quantidade_venda * custo_unidade)
+
+            nova_venda = pd.DataFrame(
+                [{'data_hora': pd.to_datetime('now', utc=True), 'sabor': sabor, 'quantidade': quantidade_venda,
+                  'preco_unidade': preco_unidade, 'custo_unidade': custo_unidade, 'total_venda': total_venda,
+                  'lucro_venda': lucro_venda}])
+            # Confirmada no journal local; o upload ao Drive acontece em segundo plano
+            await asyncio.to_thread(journal.registrar, tenant, config.DRIVE_VENDAS_FILE, nova_venda)
 
         await update.message.reply_text(
             f'✅ Venda registrada! Estoque restante de {sabor.capitalize()}: {int(estoque_atual - quantidade_venda)}')
@@ -182,55 +306,31 @@ async def consumo_pessoal(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if len(context.args) != 2: raise ValueError("Formato incorreto")
         sabor = context.args[0].lower()
         quantidade_consumo = int(context.args[1])
-        if sabor not in config.SABORES_VALIDOS:
-            await update.message.reply_text(f"❌ Sabor inválido: *{sabor}*.", parse_mode='Markdown')
-            return
-
-        hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-        service = drive.get_drive_service()
-
-        estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
-        df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
-                                              ['data', 'sabor', 'quantidade_inicial'])
-        estoque_hoje = df_estoque[df_estoque['data'].dt.date == hoje]
-
-        if estoque_hoje.empty:
-            await update.message.reply_text("⚠️ Atenção! Estoque de hoje não definido. Use `/estoque`.")
-            return
-
-        estoque_sabor = estoque_hoje[estoque_hoje['sabor'] == sabor]
-        if estoque_sabor.empty:
-            await update.message.reply_text(f"⚠️ Atenção! Não há estoque inicial para '{sabor.capitalize()}' hoje.")
+        tenant = await _obter_tenant(update)
+        if tenant is None:
             return
-
-        estoque_inicial = estoque_sabor['quantidade_inicial'].iloc[0]
-
-        vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-        df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
-                                             ['data_hora', 'sabor', 'quantidade'])
-        vendas_hoje_sabor = df_vendas[
-            (df_vendas['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje) & (df_vendas['sabor'] == sabor)]
-        ja_vendido = vendas_hoje_sabor['quantidade'].sum()
-
-        consumo_fid = drive.get_file_id(service, config.DRIVE_CONSUMO_FILE, config.DRIVE_FOLDER_ID)
-        colunas_consumo = ['data_hora', 'sabor', 'quantidade', 'custo_total']
-        df_consumo = drive.download_dataframe(service, config.DRIVE_CONSUMO_FILE, consumo_fid, colunas_consumo)
-        consumo_hoje_sabor = df_consumo[
-            (df_consumo['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje) & (df_consumo['sabor'] == sabor)]
-        ja_consumido = consumo_hoje_sabor['quantidade'].sum()
-
-        estoque_atual = estoque_inicial - ja_vendido - ja_consumido
-
-        if quantidade_consumo > estoque_atual:
-            await update.message.reply_text(f"❌ Consumo não registrado! Estoque insuficiente: *{int(estoque_atual)}*.",
-                                            parse_mode='Markdown')
+        if sabor not in tenant.sabores:
+            await update.message.reply_text(f"❌ Sabor inválido: *{sabor}*.", parse_mode='Markdown')
             return
 
-        novo_consumo = pd.DataFrame(
-            [{'data_hora': pd.to_datetime('now', utc=True), 'sabor': sabor, 'quantidade': quantidade_consumo,
-              'custo_total': quantidade_consumo * config.PRECO_FIXO_CUSTO}])
-        df_consumo = pd.concat([df_consumo, novo_consumo], ignore_index=True)
-        drive.upload_dataframe(service, df_consumo, config.DRIVE_CONSUMO_FILE, consumo_fid, config.DRIVE_FOLDER_ID)
+        hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+        async with concorrencia.travar_arquivos(tenant.id, *ARQUIVOS_ESTOQUE):
+            try:
+                frames = await _obter_retrato(tenant)
+                estoque_atual = await asyncio.to_thread(_estoque_disponivel, frames, tenant, sabor, hoje)
+            except EstoqueNaoDefinido as e:
+                await update.message.reply_text(str(e))
+                return
+
+            if quantidade_consumo > estoque_atual:
+                await update.message.reply_text(
+                    f"❌ Consumo não registrado! Estoque insuficiente: *{int(estoque_atual)}*.", parse_mode='Markdown')
+                return
+
+            novo_consumo = pd.DataFrame(
+                [{'data_hora': pd.to_datetime('now', utc=True), 'sabor': sabor, 'quantidade': quantidade_consumo,
+                  'custo_total': quantidade_consumo * schema.para_centavos(tenant.preco_custo)}])
+            await asyncio.to_thread(journal.registrar, tenant, config.DRIVE_CONSUMO_FILE, novo_consumo)
 
         await update.message.reply_text(
             f'✅ Consumo pessoal registrado! Estoque restante de {sabor.capitalize()}: {int(estoque_atual - quantidade_consumo)}')
@@ -247,36 +347,48 @@ async def relatorio_diario_handler(update: Update, context: ContextTypes.DEFAULT
     Exemplo: /diario
     """
     try:
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return
         if context.args:
             data_filtro = pd.to_datetime(context.args[0]).date()
         else:
-            data_filtro = pd.Timestamp.now(tz=config.TIMEZONE).date()
+            data_filtro = pd.Timestamp.now(tz=tenant.timezone).date()
 
-        dados = reports.gerar_dados_relatorio_diario(data_filtro)
+        dados = await asyncio.to_thread(reports.gerar_dados_relatorio_diario, tenant, data_filtro)
         await update.message.reply_text(dados['texto'], parse_mode='Markdown')
     except Exception as e:
         await update.message.reply_text(f"🐛 Erro ao gerar relatório: {e}")
 
+def _carregar_estoque_vendas_consumo(tenant):
+    """
+    Carrega estoque, vendas e consumo do tenant para consulta, baixando os três ao mesmo tempo
+    (síncrona; executada via asyncio.to_thread).
+    """
+    service = drive.get_drive_service()
+    file_ids = drive.get_file_ids(service, [config.DRIVE_ESTOQUE_FILE, config.DRIVE_VENDAS_FILE,
+                                            config.DRIVE_CONSUMO_FILE], tenant.folder_id)
+    frames = drive.download_dataframes(file_ids, {config.DRIVE_ESTOQUE_FILE: COLUNAS_ESTOQUE,
+                                                  config.DRIVE_VENDAS_FILE: COLUNAS_MOVIMENTO_SEM_TRAVA,
+                                                  config.DRIVE_CONSUMO_FILE: COLUNAS_MOVIMENTO_SEM_TRAVA},
+                                       preco_custo=tenant.preco_custo)
+    return (frames[config.DRIVE_ESTOQUE_FILE],
+            journal.com_pendentes(frames[config.DRIVE_VENDAS_FILE], tenant, config.DRIVE_VENDAS_FILE,
+                                  incluir_aplicados=True),
+            journal.com_pendentes(frames[config.DRIVE_CONSUMO_FILE], tenant, config.DRIVE_CONSUMO_FILE,
+                                  incluir_aplicados=True))
+
 async def ver_estoque_atual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Mostra o estoque atual dos sabores no dia.
     Exemplo: /ver_estoque
     """
     try:
-        hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-        service = drive.get_drive_service()
-
-        estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
-        df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
-                                              ['data', 'sabor', 'quantidade_inicial'])
-
-        vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-        df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
-                                             ['data_hora', 'sabor', 'quantidade', 'lucro_venda'])
-
-        consumo_fid = drive.get_file_id(service, config.DRIVE_CONSUMO_FILE, config.DRIVE_FOLDER_ID)
-        df_consumo = drive.download_dataframe(service, config.DRIVE_CONSUMO_FILE, consumo_fid,
-                                              ['data_hora', 'sabor', 'quantidade', 'custo_total'])
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return
+        hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+        df_estoque, df_vendas, df_consumo = await asyncio.to_thread(_carregar_estoque_vendas_consumo, tenant)
 
         estoque_hoje = df_estoque[df_estoque['data'].dt.date == hoje]
 
@@ -284,11 +396,11 @@ async def ver_estoque_atual(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Estoque de hoje ainda não definido. Use `/estoque`.")
             return
 
-        vendas_hoje = df_vendas[df_vendas['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje]
-        consumo_hoje = df_consumo[df_consumo['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == hoje]
+        vendas_hoje = df_vendas[df_vendas['data_hora'].dt.tz_convert(tenant.timezone).dt.date == hoje]
+        consumo_hoje = df_consumo[df_consumo['data_hora'].dt.tz_convert(tenant.timezone).dt.date == hoje]
 
-        vendido_por_sabor = vendas_hoje.groupby('sabor')['quantidade'].sum()
-        consumido_por_sabor = consumo_hoje.groupby('sabor')['quantidade'].sum()
+        vendido_por_sabor = vendas_hoje.groupby('sabor', observed=True)['quantidade'].sum()
+        consumido_por_sabor = consumo_hoje.groupby('sabor', observed=True)['quantidade'].sum()
 
         relatorio_texto = "📦 *Estoque Atual*\n\n"
         for index, row in estoque_hoje.iterrows():
@@ -318,10 +430,13 @@ async def gerar_grafico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             await update.message.reply_text("❌ Erro! Formato: `/grafico [dias]`")
             return
 
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return
         dias = int(context.args[0])
         await update.message.reply_text(f"Gerando gráfico de lucro dos últimos {dias} dias...")
 
-        buffer, caption = reports.gerar_grafico_lucro(dias)
+        buffer, caption = await asyncio.to_thread(reports.gerar_grafico_lucro, tenant, dias)
 
         if buffer:
             await update.message.reply_photo(photo=buffer, caption=caption, parse_mode='Markdown')
@@ -335,64 +450,84 @@ async def gerar_grafico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def relatorio_lucro_periodo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Envia o relatório de lucro dos últimos N dias.
-    Exemplo: /lucro 7
+    Envia o relatório de lucro de um período.
+    Exemplos: /lucro 7, /lucro 2025-01-01 2025-01-31 carne, /lucro semanal, /lucro mensal, /lucro diasemana 28
     """
+    formato = ("❌ Erro! Formatos: `/lucro [dias]`, `/lucro [inicio] [fim] [sabor]`, "
+               "`/lucro semanal`, `/lucro mensal` ou `/lucro diasemana [dias]`")
     try:
-        if not context.args or not context.args[0].isdigit():
-            await update.message.reply_text("❌ Erro! Formato: `/lucro [dias]`")
+        if not context.args:
+            await update.message.reply_text(formato)
             return
-
-        dias = int(context.args[0])
-        await update.message.reply_text(f"Gerando relatório de lucro dos últimos {dias} dias...")
-
-        service = drive.get_drive_service()
-        df = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE,
-                                      drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID),
-                                      ['data_hora', 'sabor', 'quantidade', 'preco_unidade', 'custo_unidade',
-                                       'total_venda', 'lucro_venda'])
-
-        if df.empty:
-            await update.message.reply_text("Nenhuma venda encontrada.")
+        tenant = await _obter_tenant(update)
+        if tenant is None:
             return
 
-        hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-        data_inicio = hoje - timedelta(days=dias - 1)
-        df_periodo = df[(df['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date >= data_inicio) & (
-                    df['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date <= hoje)]
-
-        if df_periodo.empty:
-            await update.message.reply_text(f"Nenhuma venda registrada nos últimos {dias} dias.")
+        opcao = context.args[0].lower()
+        if opcao.isdigit():
+            dias = int(opcao)
+            await update.message.reply_text(f"Gerando relatório de lucro dos últimos {dias} dias...")
+            hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+            data_inicio = hoje - timedelta(days=dias - 1)
+            texto = await asyncio.to_thread(reports.gerar_relatorio_lucro, tenant, data_inicio, hoje,
+                                            titulo=f"Lucro dos Últimos {dias} Dias")
+        elif opcao in ('semanal', 'mensal'):
+            texto = await asyncio.to_thread(reports.gerar_comparativo_lucro, tenant, opcao)
+        elif opcao == 'diasemana':
+            dias = int(context.args[1]) if len(context.args) > 1 else 28
+            texto = await asyncio.to_thread(reports.gerar_lucro_por_dia_semana, tenant, dias)
+        elif len(context.args) in (2, 3):
+            data_inicio = pd.to_datetime(context.args[0]).date()
+            data_fim = pd.to_datetime(context.args[1]).date()
+            sabor = context.args[2].lower() if len(context.args) == 3 else None
+            if sabor and sabor not in tenant.sabores:
+                await update.message.reply_text(f"❌ Sabor inválido: *{sabor}*.", parse_mode='Markdown')
+                return
+            texto = await asyncio.to_thread(reports.gerar_relatorio_lucro, tenant, data_inicio, data_fim, sabor)
+        else:
+            await update.message.reply_text(formato)
             return
 
-        lucro_total_periodo = df_periodo['lucro_venda'].sum()
-        relatorio_texto = (f"📈 *Lucro (Margem) dos Últimos {dias} Dias*\n"
-                           f"_{data_inicio.strftime('%d/%m/%Y')} a {hoje.strftime('%d/%m/%Y')}_\n\n"
-                           f"🚀 Lucro Líquido Total: *R$ {lucro_total_periodo:.2f}*")
-        await update.message.reply_text(relatorio_texto, parse_mode='Markdown')
+        await update.message.reply_text(texto, parse_mode='Markdown')
+    except ValueError:
+        await update.message.reply_text(formato)
     except Exception as e:
         await update.message.reply_text(f"Erro ao gerar relatório de período: {e}")
 
+def _csv_vendas_completo(tenant):
+    """
+    Monta o CSV com todo o histórico de vendas do tenant: arquivos anuais arquivados, arquivo quente e vendas
+    ainda no journal (síncrona). Retorna os bytes do CSV, ou None se não houver vendas.
+    """
+    service = drive.get_drive_service()
+    vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, tenant.folder_id)
+    df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
+                                         list(schema.SCHEMAS[config.DRIVE_VENDAS_FILE]),
+                                         preco_custo=tenant.preco_custo)
+    df_vendas = arquivamento.carregar_historico(service, tenant, config.DRIVE_VENDAS_FILE, df_vendas)
+    df_vendas = journal.com_pendentes(df_vendas, tenant, config.DRIVE_VENDAS_FILE, incluir_aplicados=True)
+    if df_vendas.empty:
+        return None
+    df_vendas = df_vendas.sort_values('data_hora', kind='stable')
+    return schema.expandir(df_vendas, config.DRIVE_VENDAS_FILE).to_csv(index=False).encode('utf-8')
+
 async def enviar_csv(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Envia o arquivo CSV de vendas completo.
+    Envia o arquivo CSV de vendas completo, incluindo o histórico já arquivado.
     Exemplo: /vendas
     """
     try:
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return
         await update.message.reply_text("Buscando o arquivo de vendas no Drive...")
-        service = drive.get_drive_service()
-        vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-        if not vendas_fid:
+        conteudo = await asyncio.to_thread(_csv_vendas_completo, tenant)
+        if conteudo is None:
             await update.message.reply_text("Nenhum arquivo de vendas encontrado.")
             return
 
-        request = service.files().get_media(fileId=vendas_fid)
-        fh = io.BytesIO()
-        downloader = drive.MediaIoBaseDownload(fh, request)
-        done = False
-        while not done: status, done = downloader.next_chunk()
-        fh.seek(0)
-        await update.message.reply_document(document=InputFile(fh, filename=config.DRIVE_VENDAS_FILE),
+        await update.message.reply_document(document=InputFile(io.BytesIO(conteudo),
+                                                               filename=config.DRIVE_VENDAS_FILE),
                                             caption="Aqui está o seu relatório de vendas completo.")
     except Exception as e:
         await update.message.reply_text(f"Ocorreu um erro ao enviar o arquivo: {e}")
@@ -403,9 +538,18 @@ async def fechamento_diario(update: Update, context: ContextTypes.DEFAULT_TYPE)
     Exemplo: /fechamento
     """
     try:
-        hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
+        tenant = await _obter_tenant(update)
+        if tenant is None:
+            return ConversationHandler.END
+        hoje = pd.Timestamp.now(tz=tenant.timezone).date()
         await update.message.reply_text(f"🔒 Iniciando fechamento do dia {hoje.strftime('%d/%m/%Y')}...")
-        dados_relatorio = reports.gerar_dados_relatorio_diario(hoje)
+        service = await asyncio.to_thread(drive.get_drive_service)
+        file_ids = await asyncio.to_thread(drive.get_file_ids, service,
+                                           [config.DRIVE_VENDAS_FILE, config.DRIVE_ESTOQUE_FILE,
+                                            config.DRIVE_CONSUMO_FILE, config.DRIVE_FECHAMENTOS_FILE],
+                                           tenant.folder_id)
+        dados_relatorio = await asyncio.to_thread(reports.gerar_dados_relatorio_diario, tenant, hoje,
+                                                  service=service, file_ids=file_ids)
         context.user_data['dados_fechamento'] = dados_relatorio
         await update.message.reply_text(dados_relatorio['texto'], parse_mode='Markdown')
         sobras = json.loads(dados_relatorio['sobras'])
@@ -421,37 +565,32 @@ async def fechamento_diario(update: Update, context: ContextTypes.DEFAULT_TYPE)
         else:
             # Se não houver sobras, finaliza automaticamente
             await update.message.reply_text("Nenhuma sobra de estoque encontrada. Salvando relatório...")
-            service = drive.get_drive_service()
-            fechamentos_fid = drive.get_file_id(service, config.DRIVE_FECHAMENTOS_FILE, config.DRIVE_FOLDER_ID)
+            fechamentos_fid = file_ids[config.DRIVE_FECHAMENTOS_FILE]
             colunas_fechamento = list(dados_relatorio.keys())[1:]
-            df_fechamentos = drive.download_dataframe(service, config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid,
-                                                      colunas_fechamento)
-            novo_fechamento_df = pd.DataFrame([dados_relatorio])
-            novo_fechamento_df = novo_fechamento_df.drop(columns=['texto'])
-            df_fechamentos = pd.concat([df_fechamentos, novo_fechamento_df], ignore_index=True)
-            drive.upload_dataframe(service, df_fechamentos, config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid,
-                                   config.DRIVE_FOLDER_ID)
+            async with concorrencia.travar_arquivos(tenant.id, config.DRIVE_FECHAMENTOS_FILE):
+                df_fechamentos = await asyncio.to_thread(drive.download_dataframe, service,
+                                                         config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid,
+                                                         colunas_fechamento)
+                novo_fechamento_df = pd.DataFrame([dados_relatorio])
+                novo_fechamento_df = novo_fechamento_df.drop(columns=['texto'])
+                df_fechamentos = pd.concat([df_fechamentos, novo_fechamento_df], ignore_index=True)
+                await asyncio.to_thread(drive.upload_dataframe, service, df_fechamentos,
+                                        config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid, tenant.folder_id)
             await update.message.reply_text("✅ Fechamento concluído e salvo no histórico CSV!")
             return ConversationHandler.END
     except Exception as e:
         await update.message.reply_text(f"🐛 Erro ao iniciar fechamento: {e}")
         return ConversationHandler.END
 
-async def handle_carryover_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+def _salvar_fechamento_e_sobras(tenant, dados_fechamento, sobras, lancar_sobras):
     """
-    Handler para escolha de lançar ou descartar sobras como estoque inicial do próximo dia.
+    Grava o fechamento do tenant no histórico (substituindo o do mesmo dia) e lança ou descarta as sobras
+    no estoque de amanhã. Síncrona; executada via asyncio.to_thread.
     """
-    query = update.callback_query
-    await query.answer()
-    choice = query.data
-    dados_fechamento = context.user_data.get('dados_fechamento', {})
-    if not dados_fechamento:
-        await query.edit_message_text(text="Erro: dados do fechamento não encontrados. Tente novamente.")
-        return ConversationHandler.END
-
-    sobras = json.loads(dados_fechamento.get('sobras', '{}'))
     service = drive.get_drive_service()
-    fechamentos_fid = drive.get_file_id(service, config.DRIVE_FECHAMENTOS_FILE, config.DRIVE_FOLDER_ID)
+    file_ids = drive.get_file_ids(service, [config.DRIVE_FECHAMENTOS_FILE, config.DRIVE_ESTOQUE_FILE],
+                                  tenant.folder_id)
+    fechamentos_fid = file_ids[config.DRIVE_FECHAMENTOS_FILE]
     colunas_fechamento = list(dados_fechamento.keys())[1:]
     df_fechamentos = drive.download_dataframe(service, config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid,
                                               colunas_fechamento)
@@ -461,32 +600,100 @@ async def handle_carryover_choice(update: Update, context: ContextTypes.DEFAULT_
     df_fechamentos = df_fechamentos[~(df_fechamentos['data'] == dados_fechamento['data'])]
     df_fechamentos = pd.concat([df_fechamentos, novo_fechamento_df], ignore_index=True)
     drive.upload_dataframe(service, df_fechamentos, config.DRIVE_FECHAMENTOS_FILE, fechamentos_fid,
-                           config.DRIVE_FOLDER_ID)
+                           tenant.folder_id)
 
-    amanha = pd.Timestamp.now(tz=config.TIMEZONE).date() + timedelta(days=1)
-    estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
+    amanha = pd.Timestamp.now(tz=tenant.timezone).date() + timedelta(days=1)
+    estoque_fid = file_ids[config.DRIVE_ESTOQUE_FILE]
     df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
                                           ['data', 'sabor', 'quantidade_inicial'])
 
-    if choice == "carryover_yes" and sobras:
+    if lancar_sobras and sobras:
         for sabor, quantidade in sobras.items():
             if quantidade > 0:
                 df_estoque = df_estoque[~((df_estoque['data'].dt.date == amanha) & (df_estoque['sabor'] == sabor))]
                 novo_estoque = pd.DataFrame(
                     [{'data': pd.Timestamp(amanha, tz='UTC'), 'sabor': sabor, 'quantidade_inicial': quantidade}])
                 df_estoque = pd.concat([df_estoque, novo_estoque], ignore_index=True)
-        await query.edit_message_text(text="✅ Fechamento concluído! Relatório salvo e sobras lançadas para amanhã.")
     else:
         sabores_com_sobra = [sabor for sabor, qtd in sobras.items() if qtd > 0]
         if sabores_com_sobra:
             df_estoque = df_estoque[
                 ~((df_estoque['data'].dt.date == amanha) & (df_estoque['sabor'].isin(sabores_com_sobra)))]
-        await query.edit_message_text(text="✅ Fechamento concluído! Relatório salvo e sobras descartadas.")
 
-    drive.upload_dataframe(service, df_estoque, config.DRIVE_ESTOQUE_FILE, estoque_fid, config.DRIVE_FOLDER_ID)
+    drive.upload_dataframe(service, df_estoque, config.DRIVE_ESTOQUE_FILE, estoque_fid, tenant.folder_id)
+
+async def handle_carryover_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Handler para escolha de lançar ou descartar sobras como estoque inicial do próximo dia.
+    """
+    query = update.callback_query
+    await query.answer()
+    choice = query.data
+    dados_fechamento = context.user_data.get('dados_fechamento', {})
+    if not dados_fechamento:
+        await query.edit_message_text(text="Erro: dados do fechamento não encontrados. Tente novamente.")
+        return ConversationHandler.END
+    tenant = tenants.do_chat(update.effective_chat.id)
+    if tenant is None:
+        await query.edit_message_text(text="⛔ Este chat não está vinculado a nenhuma barraca.")
+        return ConversationHandler.END
+
+    sobras = json.loads(dados_fechamento.get('sobras', '{}'))
+    async with concorrencia.travar_arquivos(tenant.id, config.DRIVE_FECHAMENTOS_FILE, config.DRIVE_ESTOQUE_FILE):
+        await asyncio.to_thread(_salvar_fechamento_e_sobras, tenant, dados_fechamento, sobras,
+                                choice == "carryover_yes")
+        descartar_retrato(tenant)
+
+    if choice == "carryover_yes" and sobras:
+        await query.edit_message_text(text="✅ Fechamento concluído! Relatório salvo e sobras lançadas para amanhã.")
+    else:
+        await query.edit_message_text(text="✅ Fechamento concluído! Relatório salvo e sobras descartadas.")
     context.user_data.clear()
     return ConversationHandler.END
 
+async def perfilar_comando(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Arma ou desarma o perfilamento de um comando (somente administradores).
+    Exemplos: /profile venda on 3, /profile venda off, /profile
+    """
+    if update.effective_user.id not in config.ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Comando restrito a administradores.")
+        return
+
+    formato = "❌ Erro! Formato: `/profile [comando] on [execuções]` ou `/profile [comando] off`"
+    if not context.args:
+        armados = perfilamento.armados()
+        if not armados:
+            await update.message.reply_text("Nenhum comando armado para perfilamento.")
+        else:
+            linhas = [f"  - /{comando}: {restantes} execução(ões)" for comando, restantes in armados.items()]
+            await update.message.reply_text("⏱ Comandos armados:\n" + "\n".join(linhas))
+        return
+
+    try:
+        comando = context.args[0].lower().lstrip('/')
+        acao = context.args[1].lower()
+        if acao == 'off':
+            desarmado = perfilamento.desarmar(comando)
+            await update.message.reply_text(f"Perfilamento de /{comando} desligado." if desarmado
+                                            else f"/{comando} não estava armado.")
+        elif acao == 'on':
+            execucoes = int(context.args[2]) if len(context.args) > 2 else 1
+            if execucoes < 1:
+                raise ValueError("execuções deve ser positivo")
+            try:
+                perfilamento.armar(comando, execucoes, update.effective_chat.id)
+            except KeyError:
+                comandos = ", ".join(f"/{nome}" for nome in perfilamento.perfilaveis())
+                await update.message.reply_text(f"❌ /{comando} não pode ser perfilado. Use um destes: {comandos}")
+                return
+            await update.message.reply_text(
+                f"⏱ As próximas {execucoes} execução(ões) de /{comando} serão perfiladas; o resumo chega aqui.")
+        else:
+            raise ValueError("ação inválida")
+    except (ValueError, IndexError):
+        await update.message.reply_text(formato)
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
     Cancela qualquer operação em andamento.
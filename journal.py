@@ -0,0 +1,263 @@
+# journal.py
+
+"""
+Journal local (write-ahead log) de vendas e consumos.
+
+O /venda e o /consumo gravam o registro aqui, com fsync, e respondem na hora; uma tarefa em segundo
+plano aplica os registros no Drive, na ordem em que chegaram. Cada registro leva um `id_registro`
+que também vai para o CSV, de modo que reaplicar (ex.: após uma queda no meio do upload) não duplica linhas.
+Ao iniciar, o bot relê o journal e reaplica o que ainda estiver pendente.
+O arquivo é único, mas a fila de pendentes é separada por tenant.
+Os registros do dia já aplicados continuam em memória para as checagens de estoque e os relatórios do dia, que
+leem o Drive sem a trava dos arquivos e podem ter baixado o arquivo antes do upload (ver handlers._estoque_disponivel).
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+import pandas as pd
+
+import concorrencia
+import config
+import google_drive as drive
+import schema
+import tenants
+
+# Registros ainda não confirmados no Drive, por tenant e em ordem de chegada:
+# {tenant_id: [{'id', 'tenant_id', 'arquivo', 'linha'}]}
+_pendentes = {}
+# Registros já aplicados no Drive, mantidos até o fim do dia local do tenant: {tenant_id: [registro]}
+_aplicados_hoje = {}
+_trava = threading.Lock()
+_loop = None
+_novo_registro = None
+_tarefa = None
+# Aplicação em andamento no replay; parar() espera por ela em vez de interrompê-la no meio do upload
+_aplicacao = None
+
+def _gravar_arquivo():
+    """Reescreve o journal de forma atômica só com os registros ainda pendentes (chamar com _trava)."""
+    temporario = config.JOURNAL_PATH + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        for registro in (r for fila in _pendentes.values() for r in fila):
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, config.JOURNAL_PATH)
+
+def carregar():
+    """
+    Lê o journal do disco para a fila de pendentes. Uma última linha incompleta (queda durante a escrita)
+    é descartada, pois aquele registro nunca foi confirmado ao usuário.
+    """
+    if not os.path.exists(config.JOURNAL_PATH):
+        return 0
+    registros = []
+    with open(config.JOURNAL_PATH, encoding='utf-8') as f:
+        for linha in f:
+            try:
+                registros.append(json.loads(linha))
+            except json.JSONDecodeError:
+                print(f"Journal: linha corrompida ignorada: {linha[:80]!r}")
+    with _trava:
+        for registro in registros:
+            # Registros anteriores ao modo multi-tenant foram gravados pelo tenant único (ID_PADRAO)
+            registro['tenant_id'] = registro.pop('tenant', None) or registro.get('tenant_id') or tenants.ID_PADRAO
+            fila = _pendentes.setdefault(registro['tenant_id'], [])
+            if all(r['id'] != registro['id'] for r in fila):
+                fila.append(registro)
+    return len(registros)
+
+def registrar(tenant, arquivo, df_linha):
+    """
+    Grava de forma durável uma nova linha (DataFrame de uma linha, no esquema compacto) destinada ao arquivo
+    do tenant. Faz fsync: os handlers a executam via asyncio.to_thread.
+    Retorna o id do registro, que também é gravado na coluna `id_registro`.
+    """
+    id_registro = uuid.uuid4().hex
+    linha = json.loads(schema.expandir(df_linha, arquivo).to_json(orient='records', date_format='iso'))[0]
+    linha['id_registro'] = id_registro
+    registro = {'id': id_registro, 'tenant_id': tenant.id, 'arquivo': arquivo, 'linha': linha}
+
+    with _trava:
+        with open(config.JOURNAL_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        _pendentes.setdefault(tenant.id, []).append(registro)
+
+    if _novo_registro is not None:
+        _loop.call_soon_threadsafe(_novo_registro.set)
+    return id_registro
+
+def _linhas_para_dataframe(arquivo, registros):
+    """Converte registros do journal para um DataFrame no esquema compacto."""
+    df = pd.DataFrame([registro['linha'] for registro in registros])
+    return schema.compactar(df, arquivo)
+
+def ids_pendentes(tenant):
+    """Ids dos registros do tenant que ainda não chegaram ao Drive."""
+    with _trava:
+        return frozenset(r['id'] for r in _pendentes.get(tenant.id, []))
+
+def com_pendentes(df, tenant, arquivo, incluir_aplicados=False):
+    """
+    Retorna o DataFrame acrescido dos registros do journal que ainda não chegaram ao Drive.
+    Usado nas checagens de estoque e relatórios, para que uma venda já confirmada conte mesmo antes do upload.
+    Com `incluir_aplicados`, acrescenta também os registros do dia já aplicados, para DataFrames que podem ter
+    sido baixados antes do upload deles.
+    """
+    with _trava:
+        registros = _aplicados_hoje.get(tenant.id, []) if incluir_aplicados else []
+        registros = [r for r in registros + _pendentes.get(tenant.id, []) if r['arquivo'] == arquivo]
+    if not registros:
+        return df
+    if 'id_registro' in df.columns:
+        ja_aplicados = set(df['id_registro'].dropna())
+        registros = [r for r in registros if r['id'] not in ja_aplicados]
+        if not registros:
+            return df
+    return pd.concat([df, _linhas_para_dataframe(arquivo, registros)], ignore_index=True)
+
+def _aplicar(tenant, arquivo, registros):
+    """Aplica no Drive os registros de um arquivo do tenant, ignorando os que já estão lá (síncrona)."""
+    service = drive.get_drive_service()
+    file_id = drive.get_file_id(service, arquivo, tenant.folder_id)
+    df = drive.download_dataframe(service, arquivo, file_id, list(registros[0]['linha'].keys()),
+                                  preco_custo=tenant.preco_custo)
+    if 'id_registro' in df.columns:
+        ja_aplicados = set(df['id_registro'].dropna())
+        registros = [r for r in registros if r['id'] not in ja_aplicados]
+    if registros:
+        df = pd.concat([df, _linhas_para_dataframe(arquivo, registros)], ignore_index=True)
+        drive.upload_dataframe(service, df, arquivo, file_id, tenant.folder_id)
+
+def _do_dia(registro, tenant, hoje):
+    return pd.Timestamp(registro['linha']['data_hora']).tz_convert(tenant.timezone).date() >= hoje
+
+def _marcar_aplicados(tenant, ids):
+    """
+    Remove os registros aplicados da fila do tenant e do arquivo do journal. Os do dia passam para
+    _aplicados_hoje, de onde saem quando o dia local do tenant vira.
+    """
+    hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+    with _trava:
+        fila = []
+        aplicados = [r for r in _aplicados_hoje.get(tenant.id, []) if _do_dia(r, tenant, hoje)]
+        for registro in _pendentes.get(tenant.id, []):
+            if registro['id'] not in ids:
+                fila.append(registro)
+            elif _do_dia(registro, tenant, hoje):
+                aplicados.append(registro)
+        for fila_do_tenant, registros in ((_pendentes, fila), (_aplicados_hoje, aplicados)):
+            if registros:
+                fila_do_tenant[tenant.id] = registros
+            else:
+                fila_do_tenant.pop(tenant.id, None)
+        _gravar_arquivo()
+
+# Destinos que falharam: {(tenant_id, arquivo): (instante da próxima tentativa, espera atual em segundos)}
+_novas_tentativas = {}
+
+async def _aplicar_destino(tenant, arquivo):
+    """Aplica os pendentes de um arquivo do tenant, com a trava do arquivo."""
+    async with concorrencia.travar_arquivos(tenant.id, arquivo):
+        with _trava:
+            registros = [r for r in _pendentes.get(tenant.id, []) if r['arquivo'] == arquivo]
+        if not registros:
+            return
+        await asyncio.to_thread(_aplicar, tenant, arquivo, registros)
+        _marcar_aplicados(tenant, {r['id'] for r in registros})
+
+async def aplicar_pendentes(ignorar_espera=False):
+    """
+    Aplica no Drive tudo o que está pendente, um arquivo por vez e na ordem de chegada.
+    A trava do arquivo cobre o upload e a remoção da fila, para que nenhuma checagem de estoque
+    veja o registro nem no Drive nem no journal.
+    Cada (tenant, arquivo) tem sua própria espera após uma falha (ex.: pasta sem permissão, cota do Drive),
+    dobrando até config.JOURNAL_ESPERA_MAXIMA; os demais tenants continuam sendo aplicados. Com
+    `ignorar_espera`, tenta todos agora.
+    Retorna em quantos segundos o próximo destino com falha deve ser tentado de novo (None se nenhum falhou).
+    """
+    with _trava:
+        destinos = list(dict.fromkeys((r['tenant_id'], r['arquivo']) for fila in _pendentes.values() for r in fila))
+    for destino in destinos:
+        tenant_id, arquivo = destino
+        tenant = tenants.por_id(tenant_id)
+        if tenant is None:
+            print(f"Journal: tenant '{tenant_id}' não está mais registrado; registros mantidos no journal.")
+            continue
+        if not ignorar_espera and destino in _novas_tentativas and _novas_tentativas[destino][0] > time.monotonic():
+            continue
+        try:
+            await _aplicar_destino(tenant, arquivo)
+        except Exception:
+            anterior = _novas_tentativas.get(destino)
+            espera = min(anterior[1] * 2, config.JOURNAL_ESPERA_MAXIMA) if anterior else 1
+            _novas_tentativas[destino] = (time.monotonic() + espera, espera)
+            print(f"--- ERRO AO APLICAR JOURNAL de '{tenant_id}' em {arquivo} (nova tentativa em {espera}s) ---\n"
+                  f"{traceback.format_exc()}")
+        else:
+            _novas_tentativas.pop(destino, None)
+
+    if not _novas_tentativas:
+        return None
+    return max(0, min(instante for instante, _ in _novas_tentativas.values()) - time.monotonic())
+
+async def _executar_replay():
+    """
+    Laço em segundo plano: aplica os pendentes a cada novo registro e, quando algum destino falhou,
+    também quando chega a hora da nova tentativa dele.
+    """
+    global _aplicacao
+    espera = None
+    while True:
+        try:
+            await asyncio.wait_for(_novo_registro.wait(), espera)
+        except asyncio.TimeoutError:
+            pass
+        _novo_registro.clear()
+        try:
+            # shield: cancelar o laço não interrompe uma aplicação que já está enviando ao Drive
+            _aplicacao = asyncio.ensure_future(aplicar_pendentes())
+            espera = await asyncio.shield(_aplicacao)
+        except Exception:
+            print(f"--- ERRO AO APLICAR JOURNAL (nova tentativa em 1s) ---\n{traceback.format_exc()}")
+            espera = 1
+
+def iniciar():
+    """Carrega o journal do disco e inicia o replay em segundo plano (chamar dentro do event loop)."""
+    global _loop, _novo_registro, _tarefa
+    _loop = asyncio.get_running_loop()
+    _novo_registro = asyncio.Event()
+    pendentes = carregar()
+    if pendentes:
+        print(f"Journal: {pendentes} registro(s) pendente(s) serão reaplicados no Drive.")
+        _novo_registro.set()
+    _tarefa = asyncio.create_task(_executar_replay())
+
+async def parar():
+    """
+    Interrompe o replay em segundo plano, espera a aplicação em andamento (se houver) terminar e faz uma
+    última tentativa de aplicar os pendentes.
+    """
+    if _tarefa is not None:
+        _tarefa.cancel()
+        try:
+            await _tarefa
+        except asyncio.CancelledError:
+            pass
+    if _aplicacao is not None and not _aplicacao.done():
+        try:
+            await _aplicacao
+        except Exception:
+            pass
+    try:
+        await aplicar_pendentes(ignorar_espera=True)
+    except Exception as e:
+        print(f"Journal: pendentes ficam para o próximo início ({e}).")
@@ -3,9 +3,14 @@
 """
 Arquivo principal de inicialização do PasteisBot.
 
-Responsável por registrar handlers, iniciar o agendador de tarefas e rodar o bot.
+Responsável por registrar handlers, iniciar o agendador de tarefas e rodar o bot
+em modo polling ou webhook (ver config.BOT_MODE).
 """
 
+import asyncio
+import traceback
+
+import pandas as pd
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,36 +19,83 @@ from telegram.ext import (
 )
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+import arquivamento
+import concorrencia
 import config
+import google_drive as drive
 import handlers
+import journal
+import perfilamento
+import tenants
+from concorrencia import ProcessadorPorChat
+import webhook
 from reports import gerar_dados_relatorio_diario
 
 async def post_init(application: Application) -> None:
     """
     Função para iniciar o agendador após o bot ligar.
     Envia relatório automático para o chat configurado.
+    Também reaplica o journal local de vendas e inicia o envio em segundo plano ao Drive,
+    e agenda o arquivamento diário do histórico antigo.
     """
+    # asyncio.to_thread usa o executor padrão; o perfilado também mede o trabalho em threads do /profile
+    asyncio.get_running_loop().set_default_executor(perfilamento.ExecutorPerfilado())
+    journal.iniciar()
+
     scheduler = AsyncIOScheduler(timezone=config.TIMEZONE)
 
-    async def job():
-        if not config.TELEGRAM_CHAT_ID:
-            print("TELEGRAM_CHAT_ID não definido. Relatório automático cancelado.")
+    async def job(tenant):
+        if not tenant.chat_relatorio:
+            print(f"Chat de relatório não definido para '{tenant.id}'. Relatório automático cancelado.")
             return
-        print(f"Executando relatório automático para o chat {config.TELEGRAM_CHAT_ID}...")
-        data_hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-        dados = gerar_dados_relatorio_diario(data_hoje)
-        await application.bot.send_message(chat_id=config.TELEGRAM_CHAT_ID, text=dados['texto'], parse_mode='Markdown')
+        print(f"Executando relatório automático de '{tenant.id}' para o chat {tenant.chat_relatorio}...")
+        data_hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+        dados = await asyncio.to_thread(gerar_dados_relatorio_diario, tenant, data_hoje)
+        await application.bot.send_message(chat_id=tenant.chat_relatorio, text=dados['texto'], parse_mode='Markdown')
+
+    async def job_arquivamento(tenant):
+        try:
+            movidas = await arquivamento.arquivar_tenant(tenant)
+            print(f"Arquivamento de '{tenant.id}': {movidas}")
+        except Exception:
+            print(f"--- ERRO NO ARQUIVAMENTO DE '{tenant.id}' ---\n{traceback.format_exc()}")
+
+    async def job_migracao(tenant):
+        try:
+            async with concorrencia.travar_arquivos(tenant.id, config.DRIVE_VENDAS_FILE):
+                service = await asyncio.to_thread(drive.get_drive_service)
+                if await asyncio.to_thread(drive.migrar_vendas_legado, service, tenant.folder_id, tenant.preco_custo):
+                    print(f"Vendas de '{tenant.id}' migradas para o formato com custo_unidade e lucro_venda.")
+        except Exception:
+            print(f"--- ERRO NA MIGRAÇÃO DE VENDAS DE '{tenant.id}' ---\n{traceback.format_exc()}")
 
-    scheduler.add_job(job, 'cron', hour=19, minute=30)
+    # Um relatório por tenant, às 19:30 no fuso horário de cada barraca, e o arquivamento de madrugada.
+    # A migração de vendas antigas roda uma vez, logo após o início.
+    for tenant in tenants.todos():
+        scheduler.add_job(job_migracao, 'date', args=[tenant], id=f"migracao_{tenant.id}")
+        scheduler.add_job(job, 'cron', hour=19, minute=30, timezone=tenant.timezone, args=[tenant],
+                          id=f"relatorio_{tenant.id}")
+        scheduler.add_job(job_arquivamento, 'cron', hour=config.ARQUIVAMENTO_HORA, minute=0,
+                          timezone=tenant.timezone, args=[tenant], id=f"arquivamento_{tenant.id}")
     scheduler.start()
-    print("Agendador de tarefas iniciado e configurado para 19:30.")
+    print(f"Agendador de tarefas iniciado e configurado para 19:30 ({len(tenants.todos())} tenant(s)).")
+
+async def post_stop(application: Application) -> None:
+    """
+    Ao desligar, tenta enviar ao Drive o que ainda estiver no journal local.
+    """
+    await journal.parar()
+
+def _comando(nome, callback):
+    """CommandHandler cujo callback pode ser perfilado com /profile."""
+    return CommandHandler(nome, perfilamento.perfilavel(nome, callback))
 
 def register_handlers(application):
     """
     Registra todos os handlers do bot.
     """
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("fechamento", handlers.fechamento_diario)],
+        entry_points=[_comando("fechamento", handlers.fechamento_diario)],
         states={
             config.ASK_CARRYOVER: [CallbackQueryHandler(handlers.handle_carryover_choice)]
         },
@@ -53,14 +105,15 @@ def register_handlers(application):
 
     application.add_handler(CommandHandler("start", handlers.start))
     application.add_handler(CommandHandler("registrar", handlers.registrar_usuario))
-    application.add_handler(CommandHandler("estoque", handlers.definir_estoque))
-    application.add_handler(CommandHandler("venda", handlers.registrar_venda))
-    application.add_handler(CommandHandler("consumo", handlers.consumo_pessoal))
-    application.add_handler(CommandHandler("diario", handlers.relatorio_diario_handler))
-    application.add_handler(CommandHandler("lucro", handlers.relatorio_lucro_periodo))
-    application.add_handler(CommandHandler("vendas", handlers.enviar_csv))
-    application.add_handler(CommandHandler("ver_estoque", handlers.ver_estoque_atual))
-    application.add_handler(CommandHandler("grafico", handlers.gerar_grafico))
+    application.add_handler(CommandHandler("profile", handlers.perfilar_comando))
+    application.add_handler(_comando("estoque", handlers.definir_estoque))
+    application.add_handler(_comando("venda", handlers.registrar_venda))
+    application.add_handler(_comando("consumo", handlers.consumo_pessoal))
+    application.add_handler(_comando("diario", handlers.relatorio_diario_handler))
+    application.add_handler(_comando("lucro", handlers.relatorio_lucro_periodo))
+    application.add_handler(_comando("vendas", handlers.enviar_csv))
+    application.add_handler(_comando("ver_estoque", handlers.ver_estoque_atual))
+    application.add_handler(_comando("grafico", handlers.gerar_grafico))
 
 def main() -> None:
     """
@@ -69,12 +122,20 @@ def main() -> None:
     if not config.TELEGRAM_TOKEN:
         raise ValueError("ERRO: Variável de ambiente TELEGRAM_TOKEN não configurada.")
 
-    application = Application.builder().token(config.TELEGRAM_TOKEN).post_init(post_init).build()
+    builder = (Application.builder().token(config.TELEGRAM_TOKEN).post_init(post_init).post_stop(post_stop)
+               .concurrent_updates(ProcessadorPorChat(config.MAX_UPDATES_CONCORRENTES)))
+    if config.BOT_MODE == 'webhook':
+        # Os updates chegam pelo nosso servidor HTTP, não pelo Updater do telegram.ext
+        builder = builder.updater(None)
+    application = builder.build()
 
     register_handlers(application)
 
-    print("Bot Modular (v13) iniciado...")
-    application.run_polling()
+    print(f"Bot Modular (v13) iniciado em modo {config.BOT_MODE}...")
+    if config.BOT_MODE == 'webhook':
+        asyncio.run(webhook.executar(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,197 @@
+# perfilamento.py
+
+"""
+Perfilamento sob demanda de comandos, para investigar lentidão em produção sem novo deploy.
+
+Um administrador arma um comando com `/profile venda on 3`; as próximas 3 execuções de /venda rodam sob o
+cProfile. O perfil cobre a thread do event loop e também as funções enviadas para threads via asyncio.to_thread
+(o executor padrão do loop é trocado por ExecutorPerfilado). As chamadas ao Drive de google_drive.py entram
+numa linha do tempo. Ao fim de cada execução, o perfil é salvo em config.PERFIS_DIR e um resumo vai para o chat
+de quem armou.
+
+Só uma execução é perfilada por vez; as que chegarem enquanto outra está sendo perfilada rodam normalmente.
+Como o event loop é compartilhado, o perfil da thread principal também inclui outras tarefas do mesmo intervalo.
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+from telegram import InputFile, Update
+from telegram.ext import ContextTypes
+
+import config
+
+TOP_FUNCOES = 12
+MAX_CHAMADAS_DRIVE = 15
+
+class _Sessao:
+    """Dados coletados durante uma execução perfilada."""
+
+    def __init__(self, comando):
+        self.comando = comando
+        self.inicio = time.perf_counter()
+        self.perfis_threads = []
+        self.chamadas_drive = []
+        self._trava = threading.Lock()
+
+    def adicionar_perfil(self, perfil):
+        with self._trava:
+            self.perfis_threads.append(perfil)
+
+    def adicionar_chamada(self, inicio, duracao, operacao):
+        with self._trava:
+            self.chamadas_drive.append((inicio - self.inicio, duracao, operacao, threading.current_thread().name))
+
+# Sessão da execução atual; asyncio.to_thread copia o contexto, então ela também é vista nas threads de trabalho
+_sessao = contextvars.ContextVar('sessao_perfil', default=None)
+
+# Comandos envolvidos por perfilavel; só eles podem ser armados
+_perfilaveis = set()
+# {comando: {'restantes': N, 'chat_id': chat que recebe o resumo}}
+_armados = {}
+_em_andamento = threading.Lock()
+
+class ExecutorPerfilado(ThreadPoolExecutor):
+    """Executor padrão do loop: perfila também o trabalho enviado para threads durante uma execução perfilada."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        # submit é chamado na thread do loop, dentro do contexto da tarefa que pediu a thread
+        sessao = _sessao.get()
+        if sessao is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def executar_perfilado():
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Python 3.12+: o cProfile da thread do loop já monitora todas as threads
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                perfil.disable()
+                sessao.adicionar_perfil(perfil)
+
+        return super().submit(executar_perfilado)
+
+@contextmanager
+def chamada_drive(operacao):
+    """Registra a duração de uma chamada ao Drive na linha do tempo da execução perfilada (se houver)."""
+    sessao = _sessao.get()
+    if sessao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        sessao.adicionar_chamada(inicio, time.perf_counter() - inicio, operacao)
+
+def perfilaveis():
+    return sorted(_perfilaveis)
+
+def armar(comando, execucoes, chat_id):
+    """Arma o comando para as próximas `execucoes`. Levanta KeyError se o comando não é perfilável."""
+    if comando not in _perfilaveis:
+        raise KeyError(comando)
+    _armados[comando] = {'restantes': execucoes, 'chat_id': chat_id}
+
+def desarmar(comando):
+    return _armados.pop(comando, None) is not None
+
+def armados():
+    return {comando: dados['restantes'] for comando, dados in _armados.items()}
+
+def _proxima_execucao(comando):
+    """Consome uma execução armada do comando; retorna o chat do resumo, ou None se não for perfilar."""
+    dados = _armados.get(comando)
+    if not dados or not _em_andamento.acquire(blocking=False):
+        return None
+    dados['restantes'] -= 1
+    if dados['restantes'] <= 0:
+        del _armados[comando]
+    return dados['chat_id']
+
+def _salvar_e_resumir(sessao, perfil_loop, duracao):
+    """Junta os perfis, salva o arquivo .prof e monta o texto do resumo. Retorna (caminho, texto)."""
+    stats = pstats.Stats(perfil_loop)
+    for perfil in sessao.perfis_threads:
+        stats.add(perfil)
+
+    os.makedirs(config.PERFIS_DIR, exist_ok=True)
+    carimbo = pd.Timestamp.now(tz=config.TIMEZONE).strftime('%Y%m%d_%H%M%S')
+    caminho = os.path.join(config.PERFIS_DIR, f"{sessao.comando}_{carimbo}.prof")
+    stats.dump_stats(caminho)
+
+    # O arquivo salvo mantém os caminhos completos; no resumo basta o nome do arquivo-fonte
+    saida = io.StringIO()
+    stats.stream = saida
+    stats.strip_dirs().sort_stats('cumulative').print_stats(TOP_FUNCOES)
+    # Só a tabela, sem o cabeçalho do pstats
+    linhas = saida.getvalue().splitlines()
+    inicio_tabela = next((i for i, linha in enumerate(linhas) if 'ncalls' in linha), 0)
+    tabela = "\n".join(linha for linha in linhas[inicio_tabela:] if linha.strip())
+
+    tempo_drive = sum(chamada[1] for chamada in sessao.chamadas_drive)
+    texto = (f"⏱ Perfil de /{sessao.comando}: {duracao:.2f}s no total, {len(sessao.chamadas_drive)} chamada(s) ao "
+             f"Drive somando {tempo_drive:.2f}s, {len(sessao.perfis_threads)} tarefa(s) em thread.\n\n"
+             f"Linha do tempo do Drive (início, duração):\n")
+    for inicio, duracao_chamada, operacao, thread in sessao.chamadas_drive[:MAX_CHAMADAS_DRIVE]:
+        texto += f"  +{inicio:.2f}s  {duracao_chamada:.2f}s  {operacao} [{thread}]\n"
+    if len(sessao.chamadas_drive) > MAX_CHAMADAS_DRIVE:
+        texto += f"  ... mais {len(sessao.chamadas_drive) - MAX_CHAMADAS_DRIVE} chamada(s)\n"
+    texto += f"\nFunções com maior tempo acumulado:\n{tabela}"
+    return caminho, texto
+
+def perfilavel(comando, callback):
+    """
+    Envolve o callback de um comando: quando o comando está armado, a execução roda sob o cProfile
+    e o resumo é enviado ao chat de quem armou.
+    """
+    _perfilaveis.add(comando)
+
+    @functools.wraps(callback)
+    async def executar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = _proxima_execucao(comando)
+        if chat_id is None:
+            return await callback(update, context)
+
+        perfil_loop = cProfile.Profile()
+        try:
+            perfil_loop.enable()
+        except ValueError:
+            # Outro profiler já está ativo no processo (ex.: depurador); roda sem perfilar
+            _em_andamento.release()
+            return await callback(update, context)
+
+        sessao = _Sessao(comando)
+        token = _sessao.set(sessao)
+        try:
+            return await callback(update, context)
+        finally:
+            perfil_loop.disable()
+            _sessao.reset(token)
+            _em_andamento.release()
+            duracao = time.perf_counter() - sessao.inicio
+            try:
+                # Juntar os perfis e gravar o .prof é trabalho de CPU e disco: fora do event loop
+                caminho, texto = await asyncio.to_thread(_salvar_e_resumir, sessao, perfil_loop, duracao)
+                await context.bot.send_message(chat_id=chat_id, text=texto[:4000])
+                with open(caminho, 'rb') as f:
+                    await context.bot.send_document(chat_id=chat_id,
+                                                    document=InputFile(f, filename=os.path.basename(caminho)))
+            except Exception as e:
+                print(f"Perfilamento: não foi possível salvar ou enviar o perfil de /{comando}: {e}")
+
+    return executar
@@ -7,34 +7,53 @@ Funções para geração de relatórios financeiros, de estoque e gráficos para
 import pandas as pd
 import json
 from datetime import datetime, timedelta
+import matplotlib
+matplotlib.use('Agg')  # Sem interface gráfica: os gráficos são gerados fora da thread principal
 import matplotlib.pyplot as plt
 import io
+import threading
 
+import analytics
+import arquivamento
 import config
 import google_drive as drive
+import journal
+import schema
 
-def gerar_dados_relatorio_diario(data_filtro):
+# Colunas lidas do Drive pelos relatórios; `id_registro` evita contar duas vezes o que ainda está no journal
+COLUNAS_VENDAS = ['data_hora', 'sabor', 'quantidade', 'total_venda', 'lucro_venda', 'id_registro']
+COLUNAS_ESTOQUE = ['data', 'sabor', 'quantidade_inicial']
+COLUNAS_CONSUMO = ['data_hora', 'sabor', 'quantidade', 'custo_total', 'id_registro']
+
+def gerar_dados_relatorio_diario(tenant, data_filtro, service=None, file_ids=None):
     """
-    Gera o relatório do dia especificado, retornando um dicionário com métricas e texto formatado.
+    Gera o relatório do tenant no dia especificado, retornando um dicionário com métricas e texto formatado.
+    Aceita um serviço e IDs já resolvidos para que comandos como /fechamento façam uma única consulta de metadados.
     """
-    service = drive.get_drive_service()
+    if service is None:
+        service = drive.get_drive_service()
+    if file_ids is None:
+        file_ids = drive.get_file_ids(service, [config.DRIVE_VENDAS_FILE, config.DRIVE_ESTOQUE_FILE,
+                                                config.DRIVE_CONSUMO_FILE], tenant.folder_id)
 
-    # Carrega vendas, estoque e consumo do dia
-    vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-    df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
-                                         ['data_hora', 'sabor', 'quantidade', 'preco_unidade', 'custo_unidade',
-                                          'total_venda', 'lucro_venda'])
-    df_vendas_dia = df_vendas[df_vendas['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == data_filtro]
+    # Carrega vendas, estoque e consumo do dia, com os três downloads ao mesmo tempo
+    frames = drive.download_dataframes(file_ids, {config.DRIVE_VENDAS_FILE: COLUNAS_VENDAS,
+                                                  config.DRIVE_ESTOQUE_FILE: COLUNAS_ESTOQUE,
+                                                  config.DRIVE_CONSUMO_FILE: COLUNAS_CONSUMO},
+                                       preco_custo=tenant.preco_custo)
+    df_vendas = frames[config.DRIVE_VENDAS_FILE]
+    df_vendas = arquivamento.carregar_historico(service, tenant, config.DRIVE_VENDAS_FILE, df_vendas, data_filtro)
+    df_vendas = journal.com_pendentes(df_vendas, tenant, config.DRIVE_VENDAS_FILE, incluir_aplicados=True)
+    df_vendas_dia = df_vendas[df_vendas['data_hora'].dt.tz_convert(tenant.timezone).dt.date == data_filtro]
 
-    estoque_fid = drive.get_file_id(service, config.DRIVE_ESTOQUE_FILE, config.DRIVE_FOLDER_ID)
-    df_estoque = drive.download_dataframe(service, config.DRIVE_ESTOQUE_FILE, estoque_fid,
-                                          ['data', 'sabor', 'quantidade_inicial'])
+    df_estoque = arquivamento.carregar_historico(service, tenant, config.DRIVE_ESTOQUE_FILE,
+                                                 frames[config.DRIVE_ESTOQUE_FILE], data_filtro)
     df_estoque_dia = df_estoque[df_estoque['data'].dt.date == data_filtro]
 
-    consumo_fid = drive.get_file_id(service, config.DRIVE_CONSUMO_FILE, config.DRIVE_FOLDER_ID)
-    colunas_consumo = ['data_hora', 'sabor', 'quantidade', 'custo_total']
-    df_consumo = drive.download_dataframe(service, config.DRIVE_CONSUMO_FILE, consumo_fid, colunas_consumo)
-    df_consumo_dia = df_consumo[df_consumo['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date == data_filtro]
+    df_consumo = arquivamento.carregar_historico(service, tenant, config.DRIVE_CONSUMO_FILE,
+                                                 frames[config.DRIVE_CONSUMO_FILE], data_filtro)
+    df_consumo = journal.com_pendentes(df_consumo, tenant, config.DRIVE_CONSUMO_FILE, incluir_aplicados=True)
+    df_consumo_dia = df_consumo[df_consumo['data_hora'].dt.tz_convert(tenant.timezone).dt.date == data_filtro]
 
     faturamento_bruto = df_vendas_dia['total_venda'].sum()
     lucro_margem = df_vendas_dia['lucro_venda'].sum()
@@ -43,14 +62,14 @@ def gerar_dados_relatorio_diario(data_filtro):
     custo_inicial_total = 0
     custo_consumo_pessoal = 0
     resultado_do_dia = lucro_margem
-    sobras_dict = {sabor: 0 for sabor in config.SABORES_VALIDOS}
+    sobras_dict = {sabor: 0 for sabor in tenant.sabores}
 
     if not df_estoque_dia.empty:
-        custo_inicial_total = df_estoque_dia['quantidade_inicial'].sum() * config.PRECO_FIXO_CUSTO
+        custo_inicial_total = df_estoque_dia['quantidade_inicial'].sum() * schema.para_centavos(tenant.preco_custo)
         custo_consumo_pessoal = df_consumo_dia['custo_total'].sum()
         resultado_do_dia = lucro_margem - custo_consumo_pessoal
 
-        for sabor in config.SABORES_VALIDOS:
+        for sabor in tenant.sabores:
             inicial = df_estoque_dia[df_estoque_dia['sabor'] == sabor]['quantidade_inicial'].sum()
             vendido = df_vendas_dia[df_vendas_dia['sabor'] == sabor]['quantidade'].sum()
             consumido = df_consumo_dia[df_consumo_dia['sabor'] == sabor]['quantidade'].sum()
@@ -59,11 +78,11 @@ def gerar_dados_relatorio_diario(data_filtro):
 
     titulo = f"📊 *Relatório do Dia: {data_filtro.strftime('%d/%m/%Y')}*"
     resumo_financeiro = (f"💰 *RESUMO FINANCEIRO*\n"
-                         f"  - Faturamento Bruto: *R$ {faturamento_bruto:.2f}*\n"
-                         f"  - Lucro (Margem das Vendas): *R$ {lucro_margem:.2f}*")
+                         f"  - Faturamento Bruto: *R$ {schema.formatar_reais(faturamento_bruto)}*\n"
+                         f"  - Lucro (Margem das Vendas): *R$ {schema.formatar_reais(lucro_margem)}*")
     gestao_estoque = "📦 *GESTÃO DE ESTOQUE*\n"
     if not df_estoque_dia.empty:
-        for sabor in config.SABORES_VALIDOS:
+        for sabor in tenant.sabores:
             inicial = df_estoque_dia[df_estoque_dia['sabor'] == sabor]['quantidade_inicial'].sum()
             vendido = df_vendas_dia[df_vendas_dia['sabor'] == sabor]['quantidade'].sum()
             consumido = df_consumo_dia[df_consumo_dia['sabor'] == sabor]['quantidade'].sum()
@@ -72,13 +91,13 @@ def gerar_dados_relatorio_diario(data_filtro):
         gestao_estoque += "_Nenhum estoque inicial definido._"
     resultado_final = "🎯 *RESULTADO FINAL DO DIA*\n"
     if not df_estoque_dia.empty:
-        resultado_final += f"  - Lucro das Vendas: `R$ {lucro_margem:.2f}`\n"
-        resultado_final += f"  - Custo do Consumo: `R$ -{custo_consumo_pessoal:.2f}`\n"
+        resultado_final += f"  - Lucro das Vendas: `R$ {schema.formatar_reais(lucro_margem)}`\n"
+        resultado_final += f"  - Custo do Consumo: `R$ -{schema.formatar_reais(custo_consumo_pessoal)}`\n"
         resultado_final += "  --------------------------------\n"
         if resultado_do_dia >= 0:
-            resultado_final += f"  - Resultado: *🚀 Lucro de R$ {resultado_do_dia:.2f}*"
+            resultado_final += f"  - Resultado: *🚀 Lucro de R$ {schema.formatar_reais(resultado_do_dia)}*"
         else:
-            resultado_final += f"  - Resultado: *📉 Prejuízo de R$ {-resultado_do_dia:.2f}*"
+            resultado_final += f"  - Resultado: *📉 Prejuízo de R$ {schema.formatar_reais(-resultado_do_dia)}*"
     else:
         resultado_final += "_Impossível calcular sem o estoque inicial._"
 
@@ -88,66 +107,152 @@ def gerar_dados_relatorio_diario(data_filtro):
         "texto": texto_final,
         "data": data_filtro.strftime('%Y-%m-%d'),
         "pasteis_vendidos": int(pasteis_vendidos),
-        "faturamento_bruto": float(faturamento_bruto),
-        "lucro_margem": float(lucro_margem),
-        "custo_investimento": float(custo_inicial_total),
-        "custo_consumo": float(custo_consumo_pessoal),
-        "resultado_final": float(resultado_do_dia),
+        "faturamento_bruto": int(faturamento_bruto),
+        "lucro_margem": int(lucro_margem),
+        "custo_investimento": int(custo_inicial_total),
+        "custo_consumo": int(custo_consumo_pessoal),
+        "resultado_final": int(resultado_do_dia),
         "sobras": json.dumps(sobras_dict)
     }
 
-def gerar_grafico_lucro(dias):
+def _lucro_liquido(totais):
+    """Margem das vendas menos o custo do consumo pessoal (em centavos)."""
+    return totais['lucro'] - totais['custo_consumo']
+
+def gerar_relatorio_lucro(tenant, data_inicio, data_fim, sabor=None, titulo=None):
+    """
+    Gera o texto de lucro do tenant entre duas datas (inclusive), opcionalmente para um único sabor.
+    As somas saem do índice de somas acumuladas, sem varrer o histórico.
+    """
+    totais = analytics.obter_indice(tenant).totais(data_inicio, data_fim, sabor)
+    periodo = f"{data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}"
+    if not totais['quantidade']:
+        return f"Nenhuma venda registrada entre {periodo}."
+
+    titulo = titulo or "Lucro do Período"
+    if sabor:
+        titulo += f" - {sabor.capitalize()}"
+    return (f"📈 *{titulo}*\n"
+            f"_{periodo}_\n\n"
+            f"  - Pastéis Vendidos: *{int(totais['quantidade'])}*\n"
+            f"  - Faturamento Bruto: *R$ {schema.formatar_reais(totais['faturamento'])}*\n"
+            f"  - Lucro das Vendas (Margem): *R$ {schema.formatar_reais(totais['lucro'])}*\n"
+            f"  - Custo do Consumo: *R$ -{schema.formatar_reais(totais['custo_consumo'])}*\n\n"
+            f"🚀 Lucro Líquido Total: *R$ {schema.formatar_reais(_lucro_liquido(totais))}*")
+
+def _variacao(atual, anterior):
+    """Formata a variação percentual entre dois valores."""
+    if not anterior:
+        return "—"
+    return f"{(atual - anterior) / abs(anterior) * 100:+.1f}%"
+
+def gerar_comparativo_lucro(tenant, periodo):
+    """
+    Compara a semana (últimos 7 dias) ou o mês corrente com o período anterior equivalente.
+    """
+    hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+    if periodo == 'semanal':
+        atual = (hoje - timedelta(days=6), hoje)
+        anterior = (hoje - timedelta(days=13), hoje - timedelta(days=7))
+        titulo = "Comparativo Semanal"
+    else:
+        inicio_mes = hoje.replace(day=1)
+        fim_mes_anterior = inicio_mes - timedelta(days=1)
+        inicio_mes_anterior = fim_mes_anterior.replace(day=1)
+        atual = (inicio_mes, hoje)
+        anterior = (inicio_mes_anterior, min(inicio_mes_anterior + (hoje - inicio_mes), fim_mes_anterior))
+        titulo = "Comparativo Mensal"
+
+    indice = analytics.obter_indice(tenant)
+    totais_atual = indice.totais(*atual)
+    totais_anterior = indice.totais(*anterior)
+    for totais in (totais_atual, totais_anterior):
+        totais['lucro_liquido'] = _lucro_liquido(totais)
+
+    linhas = [f"📊 *{titulo}*",
+              f"_Atual: {atual[0].strftime('%d/%m')} a {atual[1].strftime('%d/%m')} | "
+              f"Anterior: {anterior[0].strftime('%d/%m')} a {anterior[1].strftime('%d/%m')}_\n"]
+    for metrica, rotulo in (('quantidade', 'Pastéis Vendidos'), ('faturamento', 'Faturamento'),
+                            ('lucro', 'Lucro das Vendas'), ('lucro_liquido', 'Lucro Líquido')):
+        valor_atual, valor_anterior = totais_atual[metrica], totais_anterior[metrica]
+        if metrica == 'quantidade':
+            valores = f"{int(valor_atual)} vs {int(valor_anterior)}"
+        else:
+            valores = f"R$ {schema.formatar_reais(valor_atual)} vs R$ {schema.formatar_reais(valor_anterior)}"
+        linhas.append(f"  - {rotulo}: *{valores}* ({_variacao(valor_atual, valor_anterior)})")
+    return "\n".join(linhas)
+
+def gerar_lucro_por_dia_semana(tenant, dias):
+    """
+    Gera o detalhamento de vendas e lucro por dia da semana nos últimos N dias.
+    """
+    hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+    data_inicio = hoje - timedelta(days=dias - 1)
+    por_dia = analytics.obter_indice(tenant).por_dia_da_semana(data_inicio, hoje)
+    if not any(totais['quantidade'] for totais in por_dia):
+        return f"Nenhuma venda registrada nos últimos {dias} dias."
+
+    texto = f"📅 *Lucro por Dia da Semana (Últimos {dias} Dias)*\n\n"
+    for nome_dia, totais in zip(analytics.DIAS_DA_SEMANA, por_dia):
+        texto += f"  - `{nome_dia}`: {int(totais['quantidade'])} pastéis ➜ *R$ {schema.formatar_reais(totais['lucro'])}*\n"
+    return texto
+
+# O estado do pyplot é global: com handlers em threads paralelas, só um gráfico é desenhado por vez.
+_trava_grafico = threading.Lock()
+
+def gerar_grafico_lucro(tenant, dias):
     """
     Gera o gráfico de lucro dos últimos N dias.
     Retorna o buffer da imagem e texto de legenda.
     """
     service = drive.get_drive_service()
-    vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, config.DRIVE_FOLDER_ID)
-    df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid,
-                                         ['data_hora', 'sabor', 'quantidade', 'preco_unidade', 'custo_unidade',
-                                          'total_venda', 'lucro_venda'])
+    vendas_fid = drive.get_file_id(service, config.DRIVE_VENDAS_FILE, tenant.folder_id)
+    df_vendas = drive.download_dataframe(service, config.DRIVE_VENDAS_FILE, vendas_fid, ['data_hora', 'lucro_venda'],
+                                         colunas=['data_hora', 'lucro_venda'], preco_custo=tenant.preco_custo)
+    hoje = pd.Timestamp.now(tz=tenant.timezone).date()
+    data_inicio = hoje - timedelta(days=dias - 1)
+    df_vendas = arquivamento.carregar_historico(service, tenant, config.DRIVE_VENDAS_FILE, df_vendas, data_inicio)
 
     if df_vendas.empty:
         return None, "Nenhuma venda encontrada para gerar o gráfico."
 
-    hoje = pd.Timestamp.now(tz=config.TIMEZONE).date()
-    data_inicio = hoje - timedelta(days=dias - 1)
-    df_periodo = df_vendas[df_vendas['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date >= data_inicio]
+    df_periodo = df_vendas[df_vendas['data_hora'].dt.tz_convert(tenant.timezone).dt.date >= data_inicio]
 
     if df_periodo.empty:
         return None, f"Nenhuma venda nos últimos {dias} dias."
 
-    lucro_por_dia = df_periodo.groupby(df_periodo['data_hora'].dt.tz_convert(config.TIMEZONE).dt.date)[
-        'lucro_venda'].sum()
-
-    plt.style.use('seaborn-v0_8-whitegrid')
-    fig, ax = plt.subplots(figsize=(12, 7))
-    bars = ax.bar(lucro_por_dia.index, lucro_por_dia.values, color='#4A90E2', label='Lucro Diário')
-
-    for bar in bars:
-        yval = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width() / 2.0, yval, f'R${yval:.2f}', va='bottom' if yval >= 0 else 'top',
-                ha='center')
-
-    media_lucro = lucro_por_dia.mean()
-    ax.axhline(media_lucro, color='red', linestyle='--', linewidth=2, label=f'Média: R$ {media_lucro:.2f}')
-
-    ax.set_title(f'Lucro Líquido por Dia (Últimos {dias} Dias)', fontsize=16, pad=20)
-    ax.set_ylabel('Lucro (R$)', fontsize=12)
-    ax.set_xlabel('Data', fontsize=12)
-    ax.tick_params(axis='x', rotation=45)
-    ax.grid(axis='y', linestyle='--', alpha=0.7)
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.legend()
-    ax.set_xticklabels([d.strftime('%d/%m') for d in lucro_por_dia.index])
-    ax.set_ylim(top=ax.get_ylim()[1] * 1.15)
-
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
+    lucro_por_dia = df_periodo.groupby(df_periodo['data_hora'].dt.tz_convert(tenant.timezone).dt.date)[
+        'lucro_venda'].sum() / 100
+
+    with _trava_grafico:
+        plt.style.use('seaborn-v0_8-whitegrid')
+        fig, ax = plt.subplots(figsize=(12, 7))
+        bars = ax.bar(lucro_por_dia.index, lucro_por_dia.values, color='#4A90E2', label='Lucro Diário')
+
+        for bar in bars:
+            yval = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width() / 2.0, yval, f'R${yval:.2f}', va='bottom' if yval >= 0 else 'top',
+                    ha='center')
+
+        media_lucro = lucro_por_dia.mean()
+        ax.axhline(media_lucro, color='red', linestyle='--', linewidth=2, label=f'Média: R$ {media_lucro:.2f}')
+
+        ax.set_title(f'Lucro Líquido por Dia (Últimos {dias} Dias)', fontsize=16, pad=20)
+        ax.set_ylabel('Lucro (R$)', fontsize=12)
+        ax.set_xlabel('Data', fontsize=12)
+        ax.tick_params(axis='x', rotation=45)
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.legend()
+        ax.set_xticklabels([d.strftime('%d/%m') for d in lucro_por_dia.index])
+        ax.set_ylim(top=ax.get_ylim()[1] * 1.15)
+
+        plt.tight_layout()
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png')
+        buf.seek(0)
+        plt.close(fig)
 
     total_lucro = lucro_por_dia.sum()
     caption = (f"📈 *Relatório Gráfico de Lucro*\n\n"
@@ -0,0 +1,85 @@
+# schema.py
+
+"""
+Esquema canônico dos DataFrames em memória.
+
+Os CSVs no Drive continuam no formato original (valores em reais), mas ao carregar cada coluna é convertida
+para um tipo compacto: sabor como categoria, quantidades como inteiros pequenos, dinheiro como centavos
+inteiros (somas exatas) e datas como datetime64 UTC (int64 internamente). Ao enviar, o caminho inverso é aplicado.
+"""
+
+import pandas as pd
+
+import config
+
+# Tipos lógicos das colunas
+TIMESTAMP = 'timestamp'
+SABOR = 'sabor'
+QUANTIDADE = 'quantidade'
+DINHEIRO = 'dinheiro'
+
+SCHEMAS = {
+    config.DRIVE_VENDAS_FILE: {
+        'data_hora': TIMESTAMP, 'sabor': SABOR, 'quantidade': QUANTIDADE, 'preco_unidade': DINHEIRO,
+        'custo_unidade': DINHEIRO, 'total_venda': DINHEIRO, 'lucro_venda': DINHEIRO,
+    },
+    config.DRIVE_CONSUMO_FILE: {
+        'data_hora': TIMESTAMP, 'sabor': SABOR, 'quantidade': QUANTIDADE, 'custo_total': DINHEIRO,
+    },
+    config.DRIVE_ESTOQUE_FILE: {
+        'data': TIMESTAMP, 'sabor': SABOR, 'quantidade_inicial': QUANTIDADE,
+    },
+    config.DRIVE_FECHAMENTOS_FILE: {
+        'data': TIMESTAMP, 'pasteis_vendidos': QUANTIDADE, 'faturamento_bruto': DINHEIRO, 'lucro_margem': DINHEIRO,
+        'custo_investimento': DINHEIRO, 'custo_consumo': DINHEIRO, 'resultado_final': DINHEIRO,
+    },
+}
+
+def para_centavos(valor):
+    """Converte um valor em reais para centavos inteiros."""
+    return int(round(valor * 100))
+
+def formatar_reais(centavos):
+    """Formata um valor em centavos como texto em reais, com duas casas decimais."""
+    return f"{centavos / 100:.2f}"
+
+# Tipos usados já na leitura do CSV. Quantidades usam o inteiro com nulos (Int32) porque células vazias
+# só viram 0 em compactar; dinheiro chega em reais e vira centavos depois. Datas são convertidas à parte.
+TIPOS_LEITURA = {SABOR: 'category', QUANTIDADE: 'Int32', DINHEIRO: 'float64'}
+
+def tipos_leitura(file_name, colunas):
+    """Retorna o dtype de leitura de cada coluna do esquema presente em `colunas` (para o read_csv)."""
+    esquema = SCHEMAS.get(file_name, {})
+    return {coluna: TIPOS_LEITURA[esquema[coluna]] for coluna in colunas if esquema.get(coluna) in TIPOS_LEITURA}
+
+def colunas_de_data(file_name, colunas):
+    """Colunas de data/hora do esquema presentes em `colunas`."""
+    esquema = SCHEMAS.get(file_name, {})
+    return [coluna for coluna in colunas if esquema.get(coluna) == TIMESTAMP]
+
+def compactar(df, file_name):
+    """
+    Converte as colunas conhecidas do arquivo para o esquema compacto. Colunas fora do esquema ficam como estão.
+    """
+    for coluna, tipo in SCHEMAS.get(file_name, {}).items():
+        if coluna not in df.columns:
+            continue
+        if tipo == TIMESTAMP:
+            df[coluna] = pd.to_datetime(df[coluna], utc=True, format='ISO8601')
+        elif tipo == SABOR:
+            df[coluna] = df[coluna].astype('category')
+        elif tipo == QUANTIDADE:
+            df[coluna] = pd.to_numeric(df[coluna]).fillna(0).astype('int32')
+        elif tipo == DINHEIRO:
+            df[coluna] = (pd.to_numeric(df[coluna]).fillna(0) * 100).round().astype('int64')
+    return df
+
+def expandir(df, file_name):
+    """
+    Retorna uma cópia do DataFrame no formato dos CSVs (dinheiro em reais), pronta para ser enviada.
+    """
+    df = df.copy()
+    for coluna, tipo in SCHEMAS.get(file_name, {}).items():
+        if tipo == DINHEIRO and coluna in df.columns:
+            df[coluna] = pd.to_numeric(df[coluna]) / 100
+    return df
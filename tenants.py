@@ -0,0 +1,100 @@
+# tenants.py
+
+"""
+Registro de tenants (barracas) atendidos pelo mesmo processo do bot.
+
+Cada tenant tem sua pasta no Drive, seus sabores, preços, fuso horário e os chats que o atendem.
+O registro vem da variável de ambiente TENANTS_JSON ou do arquivo config.TENANTS_FILE, no formato:
+
+    [{"id": "centro", "chats": [123456], "drive_folder_id": "...", "sabores": ["carne", "frango"],
+      "preco_venda": 10.0, "preco_custo": 4.5, "timezone": "America/Sao_Paulo", "chat_relatorio": 123456}]
+
+Sem registro, o bot funciona como antes: um único tenant com os valores de config.py, atendendo qualquer chat.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+
+import config
+
+# Id do tenant único do modo sem registro. Registros do journal anteriores ao multi-tenant pertencem a ele.
+ID_PADRAO = 'padrao'
+
+@dataclass(frozen=True)
+class Tenant:
+    id: str
+    folder_id: str
+    sabores: tuple
+    preco_venda: float
+    preco_custo: float
+    timezone: str
+    chats: tuple = ()
+    chat_relatorio: str = None
+
+def _tenant_padrao():
+    """Tenant único montado a partir de config.py (modo de uma barraca só)."""
+    return Tenant(id=ID_PADRAO, folder_id=config.DRIVE_FOLDER_ID, sabores=tuple(config.SABORES_VALIDOS),
+                  preco_venda=config.PRECO_FIXO_VENDA, preco_custo=config.PRECO_FIXO_CUSTO,
+                  timezone=config.TIMEZONE, chat_relatorio=config.TELEGRAM_CHAT_ID)
+
+def _de_dicionario(dados):
+    """Cria um Tenant a partir de uma entrada do registro, usando config.py para os campos omitidos."""
+    return Tenant(
+        id=str(dados['id']),
+        folder_id=dados['drive_folder_id'],
+        sabores=tuple(s.lower() for s in dados.get('sabores', config.SABORES_VALIDOS)),
+        preco_venda=float(dados.get('preco_venda', config.PRECO_FIXO_VENDA)),
+        preco_custo=float(dados.get('preco_custo', config.PRECO_FIXO_CUSTO)),
+        timezone=dados.get('timezone', config.TIMEZONE),
+        chats=tuple(str(chat) for chat in dados.get('chats', [])),
+        chat_relatorio=str(dados['chat_relatorio']) if dados.get('chat_relatorio') else None,
+    )
+
+def carregar_registro():
+    """
+    Lê o registro de tenants. Retorna a lista de tenants e um índice {chat_id: tenant}.
+    Um chat só pode pertencer a um tenant.
+    """
+    if config.TENANTS_JSON:
+        entradas = json.loads(config.TENANTS_JSON)
+    elif os.path.exists(config.TENANTS_FILE):
+        with open(config.TENANTS_FILE, encoding='utf-8') as f:
+            entradas = json.load(f)
+    else:
+        return [_tenant_padrao()], None
+
+    if not isinstance(entradas, list) or not entradas:
+        raise ValueError("Registro de tenants vazio ou inválido: informe uma lista com ao menos um tenant "
+                         "(ou remova TENANTS_JSON/TENANTS_FILE para o modo de barraca única).")
+    lista = [_de_dicionario(entrada) for entrada in entradas]
+    ids = [tenant.id for tenant in lista]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Ids de tenant repetidos no registro: {ids}.")
+    por_chat = {}
+    for tenant in lista:
+        for chat in tenant.chats:
+            if chat in por_chat:
+                raise ValueError(f"Chat {chat} configurado nos tenants '{por_chat[chat].id}' e '{tenant.id}'.")
+            por_chat[chat] = tenant
+    return lista, por_chat
+
+_tenants, _por_chat = carregar_registro()
+
+def todos():
+    """Lista todos os tenants registrados."""
+    return list(_tenants)
+
+def multi_tenant():
+    """Indica se o bot está rodando com um registro de tenants (True) ou no modo de barraca única."""
+    return _por_chat is not None
+
+def do_chat(chat_id):
+    """Retorna o tenant que atende o chat, ou None se o chat não estiver registrado."""
+    if _por_chat is None:
+        return _tenants[0]
+    return _por_chat.get(str(chat_id))
+
+def por_id(tenant_id):
+    """Retorna o tenant pelo id, ou None."""
+    return next((tenant for tenant in _tenants if tenant.id == tenant_id), None)
@@ -0,0 +1,117 @@
+# webhook.py
+
+"""
+Modo webhook do PasteisBot, com servidor HTTP assíncrono embutido (aiohttp).
+
+Rotas:
+  POST config.WEBHOOK_PATH  -> recebe o JSON do Telegram e coloca o update na fila da Application
+  GET  /health              -> estado do servidor e tamanho da fila
+
+Para testar localmente, rode com BOT_MODE=webhook e envie um update de exemplo:
+  curl -X POST localhost:8080/telegram -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+       -H "Content-Type: application/json" -d @update.json
+"""
+
+import asyncio
+import hmac
+import json
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+import config
+
+CABECALHO_SEGREDO = 'X-Telegram-Bot-Api-Secret-Token'
+
+def criar_app_web(application: Application):
+    """
+    Cria o app aiohttp que alimenta a fila de updates da Application.
+    Retorna o app e o dicionário de estado usado para recusar novos updates durante o encerramento.
+    """
+    estado = {'aceitando': True}
+
+    async def receber_update(request: web.Request) -> web.Response:
+        # Sem segredo configurado nada é aceito; a comparação é feita em tempo constante
+        recebido = request.headers.get(CABECALHO_SEGREDO, '').encode()
+        if not config.WEBHOOK_SECRET or not hmac.compare_digest(recebido, config.WEBHOOK_SECRET.encode()):
+            return web.Response(status=403)
+        if not estado['aceitando']:
+            # O Telegram reenvia o update mais tarde, quando a nova instância estiver no ar
+            return web.Response(status=503)
+        try:
+            dados = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+        if not isinstance(dados, dict):
+            return web.Response(status=400)
+        try:
+            update = Update.de_json(dados, application.bot)
+        except (KeyError, TypeError, ValueError):
+            return web.Response(status=400)
+
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def saude(request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok' if estado['aceitando'] and application.running else 'encerrando',
+            'fila': application.update_queue.qsize(),
+        })
+
+    app_web = web.Application()
+    app_web.router.add_post(config.WEBHOOK_PATH, receber_update)
+    app_web.router.add_get('/health', saude)
+    return app_web, estado
+
+async def executar(application: Application) -> None:
+    """
+    Inicializa a Application, registra o webhook no Telegram e atende requisições até receber SIGINT/SIGTERM.
+    No encerramento, para de aceitar updates, termina as requisições em andamento e processa a fila antes de sair.
+    """
+    if not config.WEBHOOK_URL:
+        raise ValueError("ERRO: Variável de ambiente WEBHOOK_URL não configurada para o modo webhook.")
+    if not config.WEBHOOK_SECRET:
+        # Sem segredo, qualquer um que conheça a URL poderia enviar updates falsos ao bot
+        raise ValueError("ERRO: Variável de ambiente WEBHOOK_SECRET não configurada para o modo webhook.")
+
+    app_web, estado = criar_app_web(application)
+    runner = web.AppRunner(app_web)
+
+    await application.initialize()
+    # A partir daqui, uma falha na subida (ex.: porta em uso, erro na API do Telegram) também passa pelo
+    # encerramento completo, para que a Application seja desligada e o journal faça sua última tentativa de envio.
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                                          secret_token=config.WEBHOOK_SECRET,
+                                          allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        await runner.setup()
+        site = web.TCPSite(runner, host='0.0.0.0', port=config.PORT)
+        await site.start()
+        print(f"Servidor webhook ouvindo na porta {config.PORT} ({config.WEBHOOK_PATH}).")
+
+        parar = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sinal, parar.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        await parar.wait()
+    finally:
+        print("Encerrando: drenando updates pendentes...")
+        estado['aceitando'] = False
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        print("Servidor webhook encerrado.")